@@ -0,0 +1,174 @@
+import gzip
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import String, cast, select, text
+
+from models import Device
+from metric_types import get_metric_types
+
+DEVICE_SNAPSHOT_REFRESH_INTERVAL = int(os.getenv("DEVICE_SNAPSHOT_REFRESH_INTERVAL", "30"))  # seconds
+DEVICE_SNAPSHOT_RTT_LOOKBACK = int(os.getenv("DEVICE_SNAPSHOT_RTT_LOOKBACK", "300"))  # seconds of ping rows read per refresh
+
+EXPOSITION_CONTENT_TYPE = "text/plain; version=0.0.4"  # the response adds charset=utf-8
+
+# Metric families in exposition order; each device contributes one pre-encoded fragment per family
+_FAMILIES = [
+    b"# HELP device_status Current status of the device, as the status label.\n"
+    b"# TYPE device_status gauge\n",
+    b"# HELP device_response_time_ms Average ICMP round trip time of the latest probe.\n"
+    b"# TYPE device_response_time_ms gauge\n",
+    b"# HELP device_last_seen_timestamp_seconds When the device last answered a probe.\n"
+    b"# TYPE device_last_seen_timestamp_seconds gauge\n",
+]
+
+
+def _label_value(value: Any) -> str:
+    return str(value or "").replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _DeviceEntry:
+    __slots__ = ("labels", "status", "rtt_ms", "last_seen", "encoded")
+
+    def __init__(self, labels: str):
+        self.labels = labels
+        self.status: Optional[str] = None
+        self.rtt_ms: Optional[float] = None
+        self.last_seen: Optional[datetime] = None
+        self.encoded = (b"", b"", b"")
+
+    def encode(self):
+        """Pre-render this device's line of each family so scrapes only join bytes"""
+        labels = self.labels
+        self.encoded = (
+            f'device_status{{{labels},status="{_label_value(self.status)}"}} 1\n'.encode(),
+            f"device_response_time_ms{{{labels}}} {self.rtt_ms!r}\n".encode() if self.rtt_ms is not None else b"",
+            f"device_last_seen_timestamp_seconds{{{labels}}} {self.last_seen.timestamp():.3f}\n".encode()
+            if self.last_seen is not None else b"",
+        )
+
+
+class DeviceSnapshot:
+    """
+    In-memory status, RTT and last-seen time of every device, rendered as
+    a Prometheus text exposition.
+
+    Sweeps run by this process update it directly; refresh() reloads it
+    from the devices table and the latest ping metrics, which picks up
+    sweeps run by Celery workers and devices added or removed since. Each
+    device's lines are encoded when its values change and the whole body is
+    cached until the next change, so a scrape never queries the database.
+    """
+
+    def __init__(self):
+        self._devices: Dict[str, _DeviceEntry] = {}
+        self._lock = threading.Lock()
+        self._body: Optional[bytes] = None
+        self._gzipped: Optional[tuple] = None  # (body, gzip of body)
+        self.status_changes: Dict[str, int] = {}
+
+    def _set(self, entry: _DeviceEntry, status: Optional[str], rtt_ms: Optional[float], last_seen: Optional[datetime]):
+        if entry.status is not None and status != entry.status:
+            self.status_changes[status] = self.status_changes.get(status, 0) + 1
+        if (status, rtt_ms, last_seen) != (entry.status, entry.rtt_ms, entry.last_seen):
+            entry.status, entry.rtt_ms, entry.last_seen = status, rtt_ms, last_seen
+            entry.encode()
+            self._body = None
+
+    def record(self, device_id: Any, status: str, rtt_ms: Optional[float], last_seen: Optional[datetime]):
+        """Apply one probe outcome; devices not loaded yet wait for the next refresh"""
+        with self._lock:
+            entry = self._devices.get(str(device_id))
+            if entry is not None:
+                self._set(entry, status, entry.rtt_ms if rtt_ms is None else rtt_ms, last_seen or entry.last_seen)
+
+    def load(self, devices: Iterable[Any], rtts: Dict[str, float]):
+        """Replace the snapshot with the given devices and their latest RTTs"""
+        with self._lock:
+            previous = self._devices
+            current = {}
+            for device in devices:
+                device_id = str(device.id)
+                labels = (
+                    f'device_id="{device_id}",device_name="{_label_value(device.name)}",'
+                    f'ip_address="{_label_value(device.ip_address)}",'
+                    f'organization_id="{_label_value(device.organization_id)}"'
+                )
+                entry = previous.get(device_id)
+                if entry is None or entry.labels != labels:
+                    entry = _DeviceEntry(labels)
+                    self._body = None
+                current[device_id] = entry
+                last_seen = device.last_seen
+                if entry.last_seen and (last_seen is None or entry.last_seen > last_seen):
+                    # The table only gets last_seen every LAST_SEEN_REFRESH_INTERVAL
+                    last_seen = entry.last_seen
+                self._set(entry, device.status or "unknown", rtts.get(device_id, entry.rtt_ms), last_seen)
+            if len(current) != len(previous) or previous.keys() != current.keys():
+                self._body = None
+            self._devices = current
+
+    def refresh(self, db):
+        """Reload from the database: one pass over devices and the last few minutes of ping rows"""
+        # Ids are only ever used as label text, so skip building UUIDs for them
+        devices = db.execute(
+            select(cast(Device.id, String).label("id"), cast(Device.organization_id, String).label("organization_id"),
+                   Device.name, Device.ip_address, Device.status, Device.last_seen)
+        ).all()
+        rtts = {}
+        ping_ids = get_metric_types().ids_named("ping")
+        if ping_ids:
+            since = datetime.now(timezone.utc) - timedelta(seconds=DEVICE_SNAPSHOT_RTT_LOOKBACK)
+            rows = db.execute(
+                text(
+                    "SELECT DISTINCT ON (device_id) device_id, value FROM device_metrics "
+                    "WHERE time >= :since AND metric_type_id = ANY(:type_ids) "
+                    "ORDER BY device_id, time DESC"
+                ),
+                {"since": since, "type_ids": ping_ids},
+            )
+            rtts = {str(device_id): value for device_id, value in rows}
+        self.load(devices, rtts)
+
+    def render(self) -> bytes:
+        """The exposition body, rebuilt only after something changed"""
+        body = self._body
+        if body is not None:
+            return body
+        with self._lock:
+            if self._body is None:
+                parts: List[bytes] = []
+                for family, header in enumerate(_FAMILIES):
+                    parts.append(header)
+                    parts.extend(entry.encoded[family] for entry in self._devices.values())
+                parts.append(
+                    b"# HELP device_status_changes Status changes seen by this process, by new status.\n"
+                    b"# TYPE device_status_changes counter\n"
+                )
+                parts.extend(
+                    f'device_status_changes{{new_status="{_label_value(status)}"}} {count}\n'.encode()
+                    for status, count in sorted(self.status_changes.items())
+                )
+                self._body = b"".join(parts)
+            return self._body
+
+    def render_gzip(self) -> bytes:
+        """render(), gzip-compressed; the compressed body is cached alongside the plain one"""
+        body = self.render()
+        gzipped = self._gzipped
+        if gzipped is None or gzipped[0] is not body:
+            gzipped = self._gzipped = (body, gzip.compress(body, compresslevel=1, mtime=0))
+        return gzipped[1]
+
+
+_device_snapshot: Optional[DeviceSnapshot] = None
+
+
+def get_device_snapshot() -> DeviceSnapshot:
+    """Return the process-wide device snapshot"""
+    global _device_snapshot
+    if _device_snapshot is None:
+        _device_snapshot = DeviceSnapshot()
+    return _device_snapshot
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+PING_TIMEOUT = float(os.getenv("PING_TIMEOUT", "2.0"))
+PING_PAYLOAD_SIZE = int(os.getenv("PING_PAYLOAD_SIZE", "32"))
+PING_RECV_BUFFER = int(os.getenv("PING_RECV_BUFFER", str(4 * 1024 * 1024)))
+PING_COUNT = int(os.getenv("PING_COUNT", "3"))  # echoes per probe
+PING_BURST_INTERVAL = float(os.getenv("PING_BURST_INTERVAL", "0.2"))  # seconds between echoes
+
+
+def _checksum(data: bytes) -> int:
+    """Internet checksum (RFC 1071) of an ICMP packet"""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _build_echo_request(identifier: int, sequence: int, payload: bytes) -> bytes:
+    """Build an ICMP echo request packet with a valid checksum"""
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = _checksum(header + payload)
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence)
+    return header + payload
+
+
+class ProbeResult:
+    """Round-trip times of one burst of echoes; None marks a lost echo"""
+
+    def __init__(self, rtts: List[Optional[float]]):
+        self.rtts = rtts
+        self.received = [rtt for rtt in rtts if rtt is not None]
+
+    @property
+    def sent(self) -> int:
+        return len(self.rtts)
+
+    @property
+    def is_alive(self) -> bool:
+        return bool(self.received)
+
+    @property
+    def packet_loss(self) -> float:
+        """Lost echoes as a percentage"""
+        return 100.0 * (self.sent - len(self.received)) / self.sent if self.sent else 100.0
+
+    @property
+    def rtt_min(self) -> Optional[float]:
+        return min(self.received) if self.received else None
+
+    @property
+    def rtt_avg(self) -> Optional[float]:
+        return sum(self.received) / len(self.received) if self.received else None
+
+    @property
+    def rtt_max(self) -> Optional[float]:
+        return max(self.received) if self.received else None
+
+    @property
+    def jitter(self) -> Optional[float]:
+        """Mean absolute difference between consecutive round-trip times"""
+        if len(self.received) < 2:
+            return None
+        deltas = [abs(b - a) for a, b in zip(self.received, self.received[1:])]
+        return sum(deltas) / len(deltas)
+
+
+class IcmpPinger:
+    """
+    Asyncio ICMP echo engine.
+
+    A single socket is shared by every probe issued from the event loop.
+    Replies are matched back to their waiting probe by source address and
+    sequence number, so thousands of probes can be in flight at once without
+    spawning a ``ping`` process per device.
+
+    An unprivileged datagram ICMP socket is used when the kernel allows it
+    (``net.ipv4.ping_group_range``); otherwise a raw socket is opened, which
+    requires root or CAP_NET_RAW.
+    """
+
+    def __init__(self, timeout: float = PING_TIMEOUT, payload_size: int = PING_PAYLOAD_SIZE):
+        self.timeout = timeout
+        self.payload = bytes(payload_size)
+        self._sock: Optional[socket.socket] = None
+        self._raw = False
+        self._identifier = os.getpid() & 0xFFFF
+        self._sequence = 0
+        self._pending: Dict[Tuple[str, int], Tuple[asyncio.Future, float]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _open(self):
+        """Open the shared ICMP socket and register it with the running loop"""
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self._raw = False
+        except (PermissionError, OSError):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self._raw = True
+
+        sock.setblocking(False)
+        # Replies to a large sweep arrive in bursts; a small receive buffer
+        # silently drops them and they show up as timeouts.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, PING_RECV_BUFFER)
+        if not self._raw:
+            # The kernel rewrites the identifier of datagram ICMP sockets to
+            # the socket's local "port", so replies will carry that value.
+            sock.bind(("", 0))
+            self._identifier = sock.getsockname()[1] & 0xFFFF
+
+        self._sock = sock
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+
+    def _ensure_open(self):
+        loop = asyncio.get_running_loop()
+        if self._sock is not None and self._loop is not loop:
+            # Celery tasks run each sweep under a fresh event loop
+            self.close()
+        if self._sock is None:
+            self._open()
+
+    def _next_sequence(self, address: str) -> int:
+        for _ in range(0x10000):
+            self._sequence = (self._sequence + 1) & 0xFFFF
+            if (address, self._sequence) not in self._pending:
+                return self._sequence
+        raise RuntimeError("Too many ICMP probes in flight")
+
+    def _on_readable(self):
+        """Drain every queued reply and resolve the matching probes"""
+        while True:
+            try:
+                packet, (address, _) = self._sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+            received_at = time.monotonic()
+            if self._raw:
+                # Raw sockets deliver the IP header as well
+                packet = packet[(packet[0] & 0x0F) * 4:]
+            if len(packet) < 8:
+                continue
+
+            icmp_type, _, _, identifier, sequence = struct.unpack("!BBHHH", packet[:8])
+            if icmp_type != ICMP_ECHO_REPLY:
+                continue
+            if self._raw and identifier != self._identifier:
+                continue
+
+            entry = self._pending.get((address, sequence))
+            if entry is None:
+                continue
+            future, sent_at = entry
+            if not future.done():
+                future.set_result((received_at - sent_at) * 1000.0)
+
+    async def _resolve(self, host: str) -> str:
+        try:
+            socket.inet_aton(host)
+            return host
+        except OSError:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, family=socket.AF_INET)
+            return infos[0][4][0]
+
+    async def ping(self, host: str, timeout: Optional[float] = None) -> Optional[float]:
+        """
+        Send one echo request to ``host``.
+        Returns the round-trip time in milliseconds, or None on timeout or
+        when the host cannot be resolved or reached (no route, refused by a
+        firewall), which counts as a lost echo.
+        """
+        self._ensure_open()
+        try:
+            address = await self._resolve(host)
+        except OSError:  # includes socket.gaierror
+            return None
+        sequence = self._next_sequence(address)
+        packet = _build_echo_request(self._identifier, sequence, self.payload)
+
+        future = self._loop.create_future()
+        key = (address, sequence)
+        self._pending[key] = (future, time.monotonic())
+        try:
+            await self._loop.sock_sendto(self._sock, packet, (address, 0))
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self._pending.pop(key, None)
+
+    async def probe(
+        self,
+        host: str,
+        count: int = PING_COUNT,
+        interval: float = PING_BURST_INTERVAL,
+        timeout: Optional[float] = None,
+    ) -> ProbeResult:
+        """Send a burst of ``count`` echoes spaced ``interval`` seconds apart"""
+
+        async def echo(index: int) -> Optional[float]:
+            if index:
+                await asyncio.sleep(index * interval)
+            return await self.ping(host, timeout)
+
+        # One failed echo must not discard the rest of the burst
+        rtts = await asyncio.gather(*(echo(index) for index in range(count)), return_exceptions=True)
+        return ProbeResult([None if isinstance(rtt, BaseException) else rtt for rtt in rtts])
+
+    def close(self):
+        """Unregister and close the shared socket, failing any waiting probes"""
+        if self._sock is None:
+            return
+        try:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self._sock.fileno())
+        finally:
+            self._sock.close()
+            self._sock = None
+            self._loop = None
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+
+
+_pinger: Optional[IcmpPinger] = None
+
+
+def get_pinger() -> IcmpPinger:
+    """Return the process-wide shared pinger"""
+    global _pinger
+    if _pinger is None:
+        _pinger = IcmpPinger()
+    return _pinger
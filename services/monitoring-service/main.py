@@ -1,19 +1,43 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Depends, Header, Body, Query, Request, Response, WebSocket, WebSocketDisconnect
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 import httpx
 import os
 import asyncio
 import json
+from datetime import datetime, timedelta, timezone
+import uuid
 
-from database import get_db, engine
+from database import get_db, engine, SessionLocal
 from models import DeviceMetric, Base
-from schemas import DeviceMetricCreate, DeviceMetricResponse
+from schemas import (
+    DeviceMetricCreate, DeviceMetricResponse, MetricBatchResponse, MetricStreamResponse, MetricQuery, MetricQueryResponse,
+)
 from monitoring_service import MonitoringService
-from celery_app import celery_app
+from celery_app import celery_app, MONITORING_INTERVAL, MONITORING_SCHEDULER
+from probe_scheduler import get_probe_scheduler
+from probe_cache import get_probe_cache, status_entry
+from metric_buffer import MetricWriteBuffer
+from metric_ingest import metric_point
+from metric_types import get_metric_types
+from metric_frame import METRIC_FRAME_CONTENT_TYPE
+from metric_cache import get_metric_cache
+from ws_manager import ConnectionManager, device_topic, parse_subscriptions
+from ws_backplane import get_backplane, status_change_event
+from ws_coalesce import StatusCoalescer
+from device_snapshot import DEVICE_SNAPSHOT_REFRESH_INTERVAL, EXPOSITION_CONTENT_TYPE, get_device_snapshot
+from starlette.concurrency import run_in_threadpool
+from rollups import ROLLUPS_BY_NAME, ensure_rollups
+from sharding import ensure_ring_index
+from metric_series import columnar_metrics, downsample_metrics
+from metric_export import EXPORT_FORMATS
+from fastapi.responses import JSONResponse, StreamingResponse
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+ensure_rollups(engine)
+ensure_ring_index(engine)
 
 app = FastAPI(
     title="NetPulse Monitoring Service",
@@ -23,6 +47,10 @@ app = FastAPI(
 
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8001")
 DEVICE_SERVICE_URL = os.getenv("DEVICE_SERVICE_URL", "http://device-service:8002")
+METRICS_BATCH_MAX = int(os.getenv("METRICS_BATCH_MAX", "50000"))
+METRICS_QUERY_MAX_DEVICES = int(os.getenv("METRICS_QUERY_MAX_DEVICES", "1000"))
+METRICS_LTTB_HEADROOM = 4  # source points per LTTB output point when max_points is not given
+PROBE_WHEEL_LOCK_KEY = 0x6E7770756C7365  # PostgreSQL advisory lock held by the process running the wheel
 
 
 async def get_current_user(authorization: str = Header(...)):
@@ -40,77 +68,416 @@ async def get_current_user(authorization: str = Header(...)):
         raise HTTPException(status_code=503, detail="Auth service unavailable")
 
 
-# WebSocket Connection Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+async def authenticate_websocket(websocket: WebSocket) -> Optional[dict]:
+    """
+    User for a WebSocket handshake, from its Authorization header or, since
+    browsers cannot set headers on WebSockets, a ``token`` query parameter
+    """
+    authorization = websocket.headers.get("authorization")
+    if not authorization and websocket.query_params.get("token"):
+        authorization = f"Bearer {websocket.query_params['token']}"
+    if not authorization:
+        return None
+    try:
+        return await get_current_user(authorization)
+    except HTTPException:
+        return None
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+manager = ConnectionManager()
+coalescer = StatusCoalescer(manager)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections[:]:  # Create a copy to avoid modification during iteration
-            try:
-                await connection.send_text(message)
-            except:
-                # Remove dead connections
-                self.disconnect(connection)
 
-manager = ConnectionManager()
+def write_buffered_metrics(batch):
+    """Flush target of the metric write buffer; runs in a worker thread"""
+    db = SessionLocal()
+    try:
+        MonitoringService(db).write_metric_batch(batch)
+    finally:
+        db.close()
+
+
+metric_buffer = MetricWriteBuffer(write_buffered_metrics)
+
+
+@app.on_event("startup")
+async def start_metric_buffer():
+    metric_buffer.start()
+
+
+@app.on_event("shutdown")
+async def flush_metric_buffer():
+    """Write out buffered metrics before the process exits"""
+    await metric_buffer.stop()
+
+
+def acquire_wheel_lock():
+    """A connection holding the probe wheel's advisory lock, or None if another process holds it"""
+    conn = engine.connect()
+    try:
+        if conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": PROBE_WHEEL_LOCK_KEY}).scalar():
+            conn.commit()
+            return conn
+    except Exception as e:
+        print(f"Probe wheel lock error: {e}")
+    conn.close()
+    return None
+
+
+def wheel_lock_alive(conn) -> bool:
+    """The lock lasts as long as its session; check the session is still there"""
+    try:
+        conn.execute(text("SELECT 1"))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Probe wheel lock lost: {e}")
+        return False
+
+
+def release_wheel_lock(conn):
+    # Discard the connection rather than pooling it with the lock still held
+    conn.invalidate()
+    conn.close()
+
+
+async def run_probe_wheel():
+    """
+    Run the timing wheel in the one process that holds its advisory lock.
+    Every uvicorn worker and replica runs this; the others wait and take
+    over within MONITORING_INTERVAL seconds of the owner going away.
+    """
+    while True:
+        conn = await run_in_threadpool(acquire_wheel_lock)
+        if conn is None:
+            await asyncio.sleep(MONITORING_INTERVAL)
+            continue
+        wheel = asyncio.create_task(MonitoringService(None).start_monitoring(int(MONITORING_INTERVAL)))
+        try:
+            while await run_in_threadpool(wheel_lock_alive, conn):
+                await asyncio.sleep(MONITORING_INTERVAL)
+        finally:
+            wheel.cancel()
+            await run_in_threadpool(release_wheel_lock, conn)
+
+
+@app.on_event("startup")
+async def start_probe_scheduler():
+    """Run the timing wheel when it is the configured scheduler"""
+    if MONITORING_SCHEDULER == "wheel":
+        app.state.monitoring_task = asyncio.create_task(run_probe_wheel())
+
+
+async def refresh_device_snapshot():
+    """Keep the Prometheus device snapshot in step with sweeps run by other processes"""
+    device_snapshot = get_device_snapshot()
+    while True:
+        db = SessionLocal()
+        try:
+            await run_in_threadpool(device_snapshot.refresh, db)
+        except Exception as e:
+            print(f"Device snapshot refresh error: {e}")
+        finally:
+            db.close()
+        await asyncio.sleep(DEVICE_SNAPSHOT_REFRESH_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_device_snapshot():
+    app.state.device_snapshot_task = asyncio.create_task(refresh_device_snapshot())
+
+
+@app.get("/api/v1/metrics/devices")
+def prometheus_device_metrics(request: Request):
+    """
+    Prometheus exposition of device_status, device_response_time_ms and
+    device_last_seen_timestamp_seconds, served from the in-memory snapshot
+    """
+    device_snapshot = get_device_snapshot()
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            device_snapshot.render_gzip(), media_type=EXPOSITION_CONTENT_TYPE, headers={"Content-Encoding": "gzip"}
+        )
+    return Response(device_snapshot.render(), media_type=EXPOSITION_CONTENT_TYPE)
+
+
+@app.on_event("startup")
+async def start_connection_manager():
+    """Send heartbeats, and deliver events published by any replica to this process's sockets"""
+    manager.start()
+    await get_backplane().start(coalescer.deliver, coalescer.reset)
+
+
+@app.on_event("shutdown")
+async def stop_backplane():
+    await get_backplane().stop()
+
+
+def check_subscriptions(organization_id: Any, names: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    """Topic keys for the requested names, rejecting devices outside the organization"""
+    accepted, rejected = parse_subscriptions(organization_id, names)
+    devices = {}
+    for name in [name for name in accepted if name.startswith("device:")]:
+        try:
+            devices[uuid.UUID(accepted[name].split(":", 1)[1])] = name
+        except ValueError:
+            rejected.append(accepted.pop(name))
+    if devices:
+        db = SessionLocal()
+        try:
+            allowed = set(MonitoringService(db).organization_devices(organization_id, list(devices)))
+        finally:
+            db.close()
+        for device_id, name in devices.items():
+            if device_id in allowed:
+                accepted[name] = device_topic(device_id)
+            else:
+                del accepted[name]
+                rejected.append(name)
+    return accepted, rejected
+
+
+async def update_subscriptions(
+    connection, organization_id: Any, action: str, names: List[str], last_seq: Optional[int] = None
+):
+    accepted, rejected = await run_in_threadpool(check_subscriptions, organization_id, names)
+    if action == "subscribe":
+        manager.subscribe(connection, accepted.values())
+    else:
+        manager.unsubscribe(connection, accepted.values())
+    manager.send(connection, json.dumps({
+        "type": "subscriptions",
+        "data": {"action": action, "topics": list(accepted), "rejected": rejected},
+    }))
+    if action == "subscribe" and last_seq is not None:
+        # Nothing awaits between subscribing and queuing the replay, so no live event slips in between
+        coalescer.resume(connection, last_seq)
+
+
+def parse_last_seq(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time monitoring updates"""
-    await manager.connect(websocket)
+    """
+    WebSocket endpoint for real-time monitoring updates.
+
+    Authenticate with a ``token`` query parameter or Authorization header.
+    Clients receive events for the topics they subscribe to: the
+    ``topics`` query parameter (comma separated, default "organization"),
+    then {"type": "subscribe" | "unsubscribe", "topics": [...]} messages.
+    Topics are "organization", "device:<device_id>" and
+    "device_type:<type>", all within the caller's organization. Messages
+    are sent by the connection's writer task.
+
+    Event frames and heartbeats carry a ``seq``; a client reconnecting with
+    ``last_seq`` (query parameter, or in a subscribe message) is sent the
+    events it missed, or a "resync" message when they are no longer held.
+    """
+    user = await authenticate_websocket(websocket)
+    if user is None:
+        await websocket.close(code=1008)
+        return
+    organization_id = user.get("organization_id")
+
+    connection = await manager.connect(websocket)
     try:
-        while True:
-            # Keep connection alive
-            await asyncio.sleep(30)
-            await websocket.send_text(json.dumps({"type": "heartbeat", "data": "alive"}))
-    except WebSocketDisconnect:
+        topics = websocket.query_params.get("topics", "organization")
+        await update_subscriptions(
+            connection, organization_id, "subscribe", [name for name in topics.split(",") if name],
+            parse_last_seq(websocket.query_params.get("last_seq")),
+        )
+        while not connection.closed:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                request = json.loads(message.get("text") or "")
+            except ValueError:
+                continue
+            if isinstance(request, dict) and request.get("type") in ("subscribe", "unsubscribe") \
+                    and isinstance(request.get("topics"), list):
+                await update_subscriptions(
+                    connection, organization_id, request["type"], request["topics"],
+                    parse_last_seq(request.get("last_seq")),
+                )
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
 @app.get("/metrics/{device_id}", response_model=List[DeviceMetricResponse])
 def get_device_metrics(
     device_id: str,
+    response: Response,
     metric_type: str = None,
     hours: int = 24,
+    max_points: Optional[int] = Query(None, ge=1),
+    resolution: Optional[str] = None,
+    points: Optional[int] = Query(None, ge=3),
+    format: str = Query("rows", pattern="^(rows|columnar)$"),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get metrics for a specific device"""
-    monitoring_service = MonitoringService(db)
-    metrics = monitoring_service.get_device_metrics(device_id, metric_type, hours)
+    """
+    Get metrics for a specific device. With max_points, long windows are
+    served from the finest 1m/5m/1h rollup that keeps each metric type
+    within that many points; the chosen resolution is returned in the
+    X-Metric-Resolution header. points=N downsamples each metric type to
+    N points with LTTB, and format=columnar returns one {t, v} array pair
+    per metric type instead of a row per point.
+    """
+    if resolution is not None and resolution != "raw" and resolution not in ROLLUPS_BY_NAME:
+        raise HTTPException(status_code=400, detail=f"resolution must be raw or one of {', '.join(ROLLUPS_BY_NAME)}")
+    if points and max_points is None:
+        # LTTB needs some headroom over its target, not every raw point
+        max_points = points * METRICS_LTTB_HEADROOM
+    try:
+        device_uuid = uuid.UUID(device_id)
+    except ValueError:
+        metrics, resolution = [], resolution or "raw"
+    else:
+        # One pass picks the resolution and reads the rows, sharing the hot cache lookup
+        metrics, resolution = MonitoringService(db).query_metrics(
+            [device_uuid],
+            [metric_type] if metric_type else None,
+            datetime.now(timezone.utc) - timedelta(hours=hours),
+            max_points=max_points,
+            resolution=resolution,
+        )
+    if points:
+        metrics = downsample_metrics(metrics, points)
+
+    headers = {"X-Metric-Resolution": resolution}
+    if format == "columnar":
+        # Skips per-row response model validation, which dominates for long series
+        return JSONResponse({"resolution": resolution, "series": columnar_metrics(metrics)}, headers=headers)
+    response.headers.update(headers)
     return metrics
 
 
-@app.post("/metrics", response_model=DeviceMetricResponse)
-def create_metric(
-    metric: DeviceMetricCreate,
+@app.get("/metrics/{device_id}/export")
+def export_device_metrics(
+    device_id: str,
+    metric_type: Optional[str] = None,
+    hours: int = 24,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
 ):
-    """Create a new metric (typically called by monitoring agents)"""
+    """
+    Stream a device's raw metrics as NDJSON or CSV. Rows are read through
+    a server-side cursor and sent as they arrive, so exports of any length
+    run in bounded memory. The window defaults to the last ``hours``.
+    """
+    try:
+        device_uuid = uuid.UUID(device_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Device not found")
+    # Naive times are UTC, as for submitted metrics
+    start = start if start is None or start.tzinfo else start.replace(tzinfo=timezone.utc)
+    end = end if end is None or end.tzinfo else end.replace(tzinfo=timezone.utc)
+    start = start or (end or datetime.now(timezone.utc)) - timedelta(hours=hours)
+    if end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    db = SessionLocal()
     monitoring_service = MonitoringService(db)
-    return monitoring_service.create_metric(metric)
+    if not monitoring_service.organization_devices(current_user.get("organization_id"), [device_uuid]):
+        db.close()
+        raise HTTPException(status_code=404, detail="Device not found")
 
+    media_type, extension, encode = EXPORT_FORMATS[format]
 
-@app.get("/devices/{device_id}/status")
-async def check_device_status(
-    device_id: str,
+    def body():
+        try:
+            yield from encode(monitoring_service.iter_metrics(
+                [device_uuid], [metric_type] if metric_type else None, start, end
+            ))
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{device_id}-metrics.{extension}"'},
+    )
+
+
+@app.post("/metrics/query", response_model=MetricQueryResponse)
+def query_metrics(
+    query: MetricQuery,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Check and update device status"""
+    """
+    Metrics for many devices in one set-based query, grouped per device.
+    Takes the same max_points, resolution, points and format options as
+    GET /metrics/{device_id}; devices outside the caller's organization
+    are left out.
+    """
+    if len(query.device_ids) > METRICS_QUERY_MAX_DEVICES:
+        raise HTTPException(status_code=400, detail=f"At most {METRICS_QUERY_MAX_DEVICES} devices per query")
+    end = query.end or datetime.now(timezone.utc)
+    start = query.start or end - timedelta(hours=query.hours)
+    # Naive times are UTC, as for submitted metrics
+    end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    max_points = query.max_points
+    if query.points and max_points is None:
+        max_points = query.points * METRICS_LTTB_HEADROOM
+
     monitoring_service = MonitoringService(db)
-    
+    device_ids = monitoring_service.organization_devices(current_user.get("organization_id"), query.device_ids)
+    metrics, resolution = monitoring_service.query_metrics(
+        device_ids, query.metric_types, start, end, max_points=max_points, resolution=query.resolution
+    )
+    if query.points:
+        metrics = downsample_metrics(metrics, query.points)
+
+    devices = {device_id: [] for device_id in device_ids}
+    if query.format == "columnar":
+        for series in columnar_metrics(metrics):
+            devices[uuid.UUID(series["device_id"])].append(series)
+        return JSONResponse({"resolution": resolution, "devices": {str(key): value for key, value in devices.items()}})
+    for metric in metrics:
+        devices[metric["device_id"]].append(metric)
+    return {"resolution": resolution, "devices": devices}
+
+
+@app.post("/metrics", response_model=DeviceMetricResponse)
+async def create_metric(
+    metric: DeviceMetricCreate,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Create a new metric (typically called by monitoring agents).
+    The metric is queued for the group-commit writer and stored within
+    METRIC_BUFFER_FLUSH_INTERVAL; the request waits only while the buffer is full.
+    A metric type the registry refuses to add is rejected with 422.
+    """
+    point = metric_point(metric, datetime.now(timezone.utc))
+    key = (point[2], point[4])
+    metric_type_registry = get_metric_types()
+    if key not in metric_type_registry:
+        refused = await run_in_threadpool(metric_type_registry.admit, [key])
+        if refused:
+            raise HTTPException(status_code=422, detail=refused[key])
+    await metric_buffer.put(point)
+    time, device_id, metric_type, value, unit = point
+    return DeviceMetricResponse(device_id=device_id, metric_type=metric_type, value=value, unit=unit, time=time)
+
+
+async def probe_device_status(device_id: str, current_user: dict, monitoring_service: MonitoringService) -> dict:
+    """Look a device up in the device service, ping it and record a status change"""
     # Get device info from device service
     try:
         async with httpx.AsyncClient() as client:
@@ -141,22 +508,104 @@ async def check_device_status(
         except httpx.RequestError:
             pass  # Log error in production
         
-        # Broadcast status change
-        await manager.broadcast(json.dumps({
-            "type": "device_status_change",
-            "data": {
-                "device_id": device_id,
-                "status": new_status,
-                "timestamp": "now"
-            }
-        }))
+        # Publish status change to subscribers on every replica
+        get_backplane().publish_events([status_change_event(
+            device_info.get("organization_id") or current_user.get("organization_id"),
+            str(uuid.UUID(device_id)),
+            device_info.get("device_type"),
+            new_status,
+            datetime.now(timezone.utc),
+        )])
+    
+    # The device service only answers for devices in the caller's organization
+    return status_entry(
+        device_id,
+        device_info.get("organization_id") or current_user.get("organization_id"),
+        device_info["ip_address"],
+        new_status,
+        datetime.now(timezone.utc),
+    )
+
+
+@app.post("/metrics/batch", response_model=MetricBatchResponse)
+def create_metrics_batch(
+    metrics: List[Dict[str, Any]] = Body(...),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create many metrics in one request. Each element has the shape of
+    POST /metrics; invalid or already stored points are reported per row.
+    """
+    if len(metrics) > METRICS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {METRICS_BATCH_MAX} metrics")
+    monitoring_service = MonitoringService(db)
+    return monitoring_service.ingest_metric_batch(metrics)
+
+
+@app.post("/metrics/stream", response_model=MetricStreamResponse)
+async def stream_metrics(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create metrics from a chunked NDJSON body, one POST /metrics object per
+    line, for agents that keep a connection open and stream points.
+    """
+    monitoring_service = MonitoringService(db)
+    return await monitoring_service.ingest_metric_stream(request.stream())
+
+
+@app.post("/metrics/frames", response_model=MetricBatchResponse)
+async def create_metrics_frames(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create metrics from binary columnar frames (application/vnd.netpulse.metrics),
+    which carry the device id and metric types once per frame instead of per point.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != METRIC_FRAME_CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Expected {METRIC_FRAME_CONTENT_TYPE}")
+    body = await request.body()
+    monitoring_service = MonitoringService(db)
+    try:
+        return await run_in_threadpool(monitoring_service.ingest_metric_frames, body, METRICS_BATCH_MAX)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/devices/{device_id}/status")
+async def check_device_status(
+    device_id: str,
+    fresh: bool = False,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Device status from the probe cache, fed by sweeps in any process (through
+    the shared store) and earlier requests.
+    Pass ``fresh=true`` to force a live probe. Concurrent live probes of the
+    same device are coalesced into one.
+    """
+    monitoring_service = MonitoringService(db)
+    probe_cache = get_probe_cache()
+    organization_id = str(current_user.get("organization_id"))
+
+    async def probe():
+        return await probe_device_status(device_id, current_user, monitoring_service)
+
+    flight_key = (device_id, organization_id)
+    result = await probe_cache.get_or_probe(device_id, probe, fresh=fresh, flight_key=flight_key)
+    if result["organization_id"] != organization_id:
+        # Never serve another organization's cached entry; a live probe goes
+        # through the device service's access check
+        result = await probe_cache.get_or_probe(device_id, probe, fresh=True, flight_key=flight_key)
     
-    return {
-        "device_id": device_id,
-        "status": new_status,
-        "is_online": is_online,
-        "ip_address": device_info["ip_address"]
-    }
+    return {key: value for key, value in result.items() if key != "organization_id"}
 
 
 @app.post("/trigger-monitoring")
@@ -167,6 +616,30 @@ def trigger_monitoring(current_user: dict = Depends(get_current_user)):
     return {"message": "Monitoring task triggered"}
 
 
+@app.get("/monitoring/schedule")
+def get_probe_schedule(current_user: dict = Depends(get_current_user)):
+    """Probe load of the timing wheel scheduler, for sizing workers"""
+    return {"scheduler": MONITORING_SCHEDULER, **get_probe_scheduler().stats()}
+
+
+@app.get("/monitoring/metric-buffer")
+def get_metric_buffer_stats(current_user: dict = Depends(get_current_user)):
+    """Queue depth, flush size and flush latency of the metric write buffer"""
+    return metric_buffer.stats()
+
+
+@app.get("/monitoring/metric-cache")
+def get_metric_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Size, hit ratio and evictions of the in-memory hot metric cache"""
+    return get_metric_cache().stats()
+
+
+@app.get("/monitoring/websocket")
+def get_websocket_stats(current_user: dict = Depends(get_current_user)):
+    """Connections, queued messages and slow consumer handling of /ws, and backplane traffic"""
+    return {**manager.stats(), "backplane": get_backplane().stats(), "coalescer": coalescer.stats()}
+
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
@@ -175,4 +648,6 @@ def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8003)
+    # Same switch the uvicorn CLI reads; compression pays off on large device_status_batch frames
+    per_message_deflate = os.getenv("UVICORN_WS_PER_MESSAGE_DEFLATE", "true").lower() not in ("0", "false", "no")
+    uvicorn.run(app, host="0.0.0.0", port=8003, ws_per_message_deflate=per_message_deflate)
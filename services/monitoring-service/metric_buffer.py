@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from metric_ingest import MetricBatch, MetricPoint
+
+METRIC_BUFFER_FLUSH_ROWS = int(os.getenv("METRIC_BUFFER_FLUSH_ROWS", "5000"))
+METRIC_BUFFER_FLUSH_INTERVAL = float(os.getenv("METRIC_BUFFER_FLUSH_INTERVAL", "0.2"))  # seconds
+METRIC_BUFFER_MAX_ROWS = int(os.getenv("METRIC_BUFFER_MAX_ROWS", "100000"))
+METRIC_BUFFER_FLUSH_RETRIES = 3
+FLUSH_POLL_INTERVAL = 0.01
+
+_STOP = object()  # queued by stop() behind every pending point
+
+
+class MetricWriteBuffer:
+    """
+    Write-behind buffer for device_metrics.
+
+    Points are queued in memory and written by a single flusher task, one
+    transaction per flush, once METRIC_BUFFER_FLUSH_ROWS points are waiting
+    or METRIC_BUFFER_FLUSH_INTERVAL seconds after the first of them arrived.
+    The queue holds at most METRIC_BUFFER_MAX_ROWS points; producers wait
+    when it is full, which pushes back on clients instead of growing memory.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[MetricBatch], Any],
+        flush_rows: int = METRIC_BUFFER_FLUSH_ROWS,
+        flush_interval: float = METRIC_BUFFER_FLUSH_INTERVAL,
+        max_rows: int = METRIC_BUFFER_MAX_ROWS,
+    ):
+        self.write = write
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.last_flush_rows = 0
+        self.max_flush_rows = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_rows)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out everything still queued"""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def put(self, point: MetricPoint):
+        """Queue a point, waiting while the buffer is full"""
+        await self._queue.put(point)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            point = await self._queue.get()
+            if point is _STOP:
+                return
+            points = [point]
+            deadline = loop.time() + self.flush_interval
+            while len(points) < self.flush_rows:
+                while len(points) < self.flush_rows and not self._queue.empty():
+                    point = self._queue.get_nowait()
+                    if point is _STOP:
+                        stopping = True
+                        break
+                    points.append(point)
+                remaining = deadline - loop.time()
+                if stopping or remaining <= 0:
+                    break
+                # Poll rather than wait_for(queue.get()), which can drop an
+                # item that arrives just as the timeout fires
+                await asyncio.sleep(min(remaining, FLUSH_POLL_INTERVAL))
+            await self._flush(points)
+
+    async def _flush(self, points: List[MetricPoint]):
+        if not points:
+            return
+        batch = MetricBatch()
+        for index, point in enumerate(points):
+            batch.add_point(index, point)
+
+        started = time.perf_counter()
+        for attempt in range(1, METRIC_BUFFER_FLUSH_RETRIES + 1):
+            try:
+                await run_in_threadpool(self.write, batch)
+                break
+            except Exception as e:
+                print(f"Metric buffer flush failed (attempt {attempt}): {e}")
+                if attempt == METRIC_BUFFER_FLUSH_RETRIES:
+                    self.rows_dropped += len(points)
+                    return
+                await asyncio.sleep(attempt)
+
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.rows_written += len(batch)
+        self.last_flush_rows = len(points)
+        self.max_flush_rows = max(self.max_flush_rows, len(points))
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "capacity": self.max_rows,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "last_flush_rows": self.last_flush_rows,
+            "max_flush_rows": self.max_flush_rows,
+            "avg_flush_rows": round(self.rows_written / self.flushes, 1) if self.flushes else 0,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 2),
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 2),
+            "avg_flush_ms": round(self.total_flush_seconds * 1000 / self.flushes, 2) if self.flushes else 0,
+        }
@@ -0,0 +1,234 @@
+import os
+import threading
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Off by default: only safe when this process writes every point of the series it serves
+METRIC_CACHE_MAX_BYTES = int(os.getenv("METRIC_CACHE_MAX_BYTES", "0"))  # e.g. 67108864; 0 disables the cache
+METRIC_CACHE_SERIES_POINTS = int(os.getenv("METRIC_CACHE_SERIES_POINTS", "720"))  # ring size per series
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+_SERIES_OVERHEAD = 240  # bytes per series besides its arrays: two array headers, slots object, dict entry
+_DEVICE_OVERHEAD = 400  # bytes per device entry and its LRU/dict slots
+_POINT_BYTES = 16  # one int64 timestamp and one float64 value
+
+# (time in epoch microseconds, value, metric_type_id)
+CachedPoint = Tuple[int, float, int]
+
+
+def to_micros(moment: datetime) -> int:
+    return (moment - _EPOCH) // _ONE_MICROSECOND
+
+
+def from_micros(micros: int) -> datetime:
+    return _EPOCH + micros * _ONE_MICROSECOND
+
+
+class _Series:
+    """
+    Ring buffer of one (device, metric type) series, oldest point at
+    ``start``. Every point at or after ``covered_from`` that was ingested
+    by this process is present, so a range starting there can be answered
+    without the database.
+    """
+
+    __slots__ = ("times", "values", "start", "covered_from")
+
+    def __init__(self, covered_from: int):
+        self.times = array("q")
+        self.values = array("d")
+        self.start = 0
+        self.covered_from = covered_from
+
+    def __len__(self):
+        return len(self.times)
+
+    def ordered(self) -> Tuple[List[int], List[float]]:
+        times, values = self.times.tolist(), self.values.tolist()
+        return times[self.start:] + times[:self.start], values[self.start:] + values[:self.start]
+
+    def newest(self) -> int:
+        return self.times[self.start - 1]
+
+    def add(self, micros: int, value: float, capacity: int) -> int:
+        """Insert a point; returns the growth in stored points (0 or 1)"""
+        if micros < self.covered_from:
+            return 0  # older than anything we vouch for; the database has it
+        size = len(self.times)
+        if size and micros <= self.newest():
+            return self._insert(micros, value, capacity)
+        if size < capacity:
+            self.times.append(micros)
+            self.values.append(value)
+            return 1
+        # Full: overwrite the oldest point, after which we only vouch for later times
+        self.covered_from = self.times[self.start] + 1
+        self.times[self.start] = micros
+        self.values[self.start] = value
+        self.start = (self.start + 1) % size
+        return 0
+
+    def _insert(self, micros: int, value: float, capacity: int) -> int:
+        """Out-of-order point: rebuild in order; rare, so O(n) is fine"""
+        times, values = self.ordered()
+        position = bisect_left(times, micros)
+        if position < len(times) and times[position] == micros:
+            return 0  # stored first wins, as with ON CONFLICT DO NOTHING
+        times.insert(position, micros)
+        values.insert(position, value)
+        grown = 1
+        if len(times) > capacity:
+            self.covered_from = times.pop(0) + 1
+            values.pop(0)
+            grown = 0
+        self.times = array("q", times)
+        self.values = array("d", values)
+        self.start = 0
+        return grown
+
+    def between(self, start: int, end: Optional[int]) -> Iterable[Tuple[int, float]]:
+        times, values = self.ordered()
+        first = bisect_left(times, start)
+        last = len(times) if end is None else bisect_left(times, end)
+        return zip(times[first:last], values[first:last])
+
+
+class _Device:
+    __slots__ = ("tracked_since", "series")
+
+    def __init__(self, tracked_since: int):
+        self.tracked_since = tracked_since
+        self.series: Dict[int, _Series] = {}
+
+
+class HotMetricCache:
+    """
+    Recent raw metrics per (device, metric type), kept in memory as they
+    are written.
+
+    A series is tracked from the first point this process stores for it.
+    From then on every stored point is appended to its ring buffer of
+    METRIC_CACHE_SERIES_POINTS points, so raw queries for named metric types
+    whose window starts after each series was first seen (and after the
+    oldest point its ring has overwritten) are answered from memory. A
+    series this process was never fed, and any query for all types, is a
+    miss. Devices are evicted least recently used first once the estimated
+    footprint exceeds METRIC_CACHE_MAX_BYTES.
+
+    Only points written by this process are seen, so it is disabled by
+    default. Enable it only when this process is the sole writer of the
+    series it serves: a single uvicorn worker with MONITORING_SCHEDULER=wheel
+    (Celery workers write the probe metrics otherwise), and no other replica
+    or worker ingesting the same devices.
+    """
+
+    def __init__(self, max_bytes: int = METRIC_CACHE_MAX_BYTES, series_points: int = METRIC_CACHE_SERIES_POINTS):
+        self.max_bytes = max_bytes
+        self.series_points = series_points
+        self._devices: "OrderedDict[uuid.UUID, _Device]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def add(self, points: Iterable[Tuple[uuid.UUID, datetime, int, float]], now: Optional[datetime] = None):
+        """Record stored points given as (device_id, time, metric_type_id, value)"""
+        if not self.enabled:
+            return
+        tracked_since = to_micros(now or datetime.now(timezone.utc))
+        with self._lock:
+            for device_id, time, type_id, value in points:
+                device = self._devices.get(device_id)
+                if device is None:
+                    device = self._devices[device_id] = _Device(tracked_since)
+                    self.bytes += _DEVICE_OVERHEAD
+                else:
+                    self._devices.move_to_end(device_id)
+                series = device.series.get(type_id)
+                if series is None:
+                    # Vouch only from now: earlier points of this type may come from another writer
+                    series = device.series[type_id] = _Series(tracked_since)
+                    self.bytes += _SERIES_OVERHEAD
+                self.bytes += _POINT_BYTES * series.add(to_micros(time), value, self.series_points)
+            self._evict()
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self._devices) > 1:
+            _, device = self._devices.popitem(last=False)
+            self.bytes -= _DEVICE_OVERHEAD + sum(
+                _SERIES_OVERHEAD + _POINT_BYTES * len(series) for series in device.series.values()
+            )
+            self.evictions += 1
+
+    def get(
+        self,
+        device_id: uuid.UUID,
+        type_ids: Optional[List[int]],
+        start_time: datetime,
+        end_time: Optional[datetime] = None,
+    ) -> Optional[List[CachedPoint]]:
+        """
+        Raw points of a device in [start_time, end_time), ordered by time,
+        or None when the cache cannot vouch for the whole range. Every type
+        must be named and fed to this process; points of types it never saw
+        may still exist, written by another process.
+        """
+        if not self.enabled:
+            return None
+        if not type_ids:
+            self.misses += 1
+            return None
+        start = to_micros(start_time)
+        end = None if end_time is None else to_micros(end_time)
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None or device.tracked_since > start:
+                self.misses += 1
+                return None
+            points = []
+            for type_id in type_ids:
+                series = device.series.get(type_id)
+                if series is None or series.covered_from > start:
+                    self.misses += 1
+                    return None
+                points.extend((micros, value, type_id) for micros, value in series.between(start, end))
+            self._devices.move_to_end(device_id)
+            self.hits += 1
+        points.sort(key=lambda point: point[0])
+        return points
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        with self._lock:
+            series = sum(len(device.series) for device in self._devices.values())
+        return {
+            "devices": len(self._devices),
+            "series": series,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+_metric_cache: Optional[HotMetricCache] = None
+
+
+def get_metric_cache() -> HotMetricCache:
+    """Return the process-wide hot metric cache"""
+    global _metric_cache
+    if _metric_cache is None:
+        _metric_cache = HotMetricCache()
+    return _metric_cache
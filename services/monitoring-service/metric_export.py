@@ -0,0 +1,47 @@
+import csv
+import io
+import json
+from typing import Any, Dict, Iterable, Iterator, List
+
+# Batches of rows as yielded by MonitoringService.iter_metrics
+MetricBatches = Iterable[List[Dict[str, Any]]]
+
+EXPORT_COLUMNS = ("time", "device_id", "metric_type", "value", "unit")
+
+
+def ndjson_chunks(batches: MetricBatches) -> Iterator[bytes]:
+    """One JSON object per line, one chunk per batch"""
+    for rows in batches:
+        yield "".join(
+            json.dumps({
+                "time": row["time"].isoformat(),
+                "device_id": str(row["device_id"]),
+                "metric_type": row["metric_type"],
+                "value": row["value"],
+                "unit": row["unit"],
+            }) + "\n"
+            for row in rows
+        ).encode()
+
+
+def csv_chunks(batches: MetricBatches) -> Iterator[bytes]:
+    """A header line, then one chunk of CSV rows per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (row["time"].isoformat(), row["device_id"], row["metric_type"], row["value"], row["unit"])
+            for row in rows
+        )
+        yield buffer.getvalue().encode()
+
+
+# format -> (media type, file extension, encoder)
+EXPORT_FORMATS: Dict[str, tuple] = {
+    "ndjson": ("application/x-ndjson", "ndjson", ndjson_chunks),
+    "csv": ("text/csv", "csv", csv_chunks),
+}
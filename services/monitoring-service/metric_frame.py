@@ -0,0 +1,176 @@
+"""
+Binary columnar metric frames (Content-Type: application/vnd.netpulse.metrics).
+
+A request body is one or more frames. All integers are little-endian:
+
+    u32   length of the rest of the frame
+    4s    magic b"NPM1"
+    16s   device id (UUID bytes)
+    u16   number of metric types, then for each:
+              u8 length + UTF-8 metric_type
+              u8 length + UTF-8 unit (length 0 means no unit)
+    u32   number of points N, then three columns:
+              N x i64  time, milliseconds since the Unix epoch
+              N x f64  value
+              N x u16  index into the metric type table
+
+The columns are read straight out of the request body through memoryview
+casts; no per-point validation objects are built.
+"""
+import math
+import struct
+import sys
+import uuid
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from metric_ingest import MetricBatch
+
+METRIC_FRAME_CONTENT_TYPE = "application/vnd.netpulse.metrics"
+FRAME_MAGIC = b"NPM1"
+
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def _column(data: memoryview, typecode: str):
+    """View a little-endian column as a sequence of ``typecode`` items"""
+    if _LITTLE_ENDIAN:
+        return data.cast(typecode)
+    column = array(typecode, data)
+    column.byteswap()
+    return column
+
+
+class _Reader:
+    def __init__(self, data: memoryview):
+        self.data = data
+        self.offset = 0
+
+    def take(self, size: int) -> memoryview:
+        end = self.offset + size
+        if end > len(self.data):
+            raise ValueError(f"frame truncated at byte {self.offset}")
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def unpack(self, fmt: struct.Struct) -> int:
+        return fmt.unpack(self.take(fmt.size))[0]
+
+    def text(self) -> Optional[str]:
+        size = self.unpack(_U8)
+        if not size:
+            return None
+        try:
+            return str(self.take(size), "utf-8")
+        except UnicodeDecodeError:
+            raise ValueError(f"invalid UTF-8 in metric type table at byte {self.offset - size}")
+
+
+def decode_metric_frames(body: bytes, batch: MetricBatch, max_points: int) -> int:
+    """
+    Add every point of every frame in ``body`` to ``batch``, indexed by
+    position across the whole body. Raises ValueError for a malformed body;
+    individual points with an unknown metric type or a non-finite value are
+    rejected in the batch. Returns the number of points read.
+    """
+    data = memoryview(body)
+    seen = {}  # device id -> (time_ms, metric_type) already in the batch
+    position = 0
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < _U32.size:
+            raise ValueError(f"frame truncated at byte {offset}")
+        length = _U32.unpack_from(data, offset)[0]
+        start = offset + _U32.size
+        if start + length > len(data):
+            raise ValueError(f"frame at byte {offset} is longer than the body")
+        position = _decode_frame(data[start:start + length], batch, position, max_points, seen)
+        offset = start + length
+    return position
+
+
+def _decode_frame(frame: memoryview, batch: MetricBatch, position: int, max_points: int, seen: Dict) -> int:
+    reader = _Reader(frame)
+    if reader.take(len(FRAME_MAGIC)) != FRAME_MAGIC:
+        raise ValueError("not a metric frame")
+    device_id = uuid.UUID(bytes=bytes(reader.take(16)))
+
+    types: List[Tuple[str, Optional[str]]] = []
+    for _ in range(reader.unpack(_U16)):
+        metric_type = reader.text()
+        if metric_type is None:
+            raise ValueError("empty metric type")
+        types.append((metric_type, reader.text()))
+
+    count = reader.unpack(_U32)
+    if position + count > max_points:
+        raise ValueError(f"body holds more than {max_points} points")
+    times = _column(reader.take(count * 8), "q")
+    values = _column(reader.take(count * 8), "d")
+    type_indexes = _column(reader.take(count * 2), "H")
+    if reader.offset != len(frame):
+        raise ValueError("trailing bytes after frame columns")
+
+    # Agents usually report several metrics per timestamp; build each datetime once
+    stamps = {}
+    device_seen = seen.setdefault(device_id, set())
+    type_count = len(types)
+    for time_ms, value, type_index in zip(times.tolist(), values.tolist(), type_indexes.tolist()):
+        if type_index >= type_count:
+            batch.reject(position, f"metric type index {type_index} out of range")
+        elif not math.isfinite(value):
+            batch.reject(position, "value must be finite")
+        else:
+            metric_type, unit = types[type_index]
+            key = (time_ms, metric_type)
+            stamp = stamps.get(time_ms)
+            if stamp is None:
+                try:
+                    stamp = stamps[time_ms] = _EPOCH + timedelta(milliseconds=time_ms)
+                except OverflowError:
+                    stamp = None
+            if stamp is None:
+                batch.reject(position, "time out of range")
+            elif key in device_seen:
+                batch.reject(position, "duplicate point in batch")
+            else:
+                device_seen.add(key)
+                batch.append(position, (stamp, device_id, metric_type, value, unit))
+        position += 1
+    return position
+
+
+def encode_metric_frame(device_id: uuid.UUID, points) -> bytes:
+    """
+    Build one frame for ``device_id`` from ``(time, metric_type, value, unit)``
+    tuples, ``time`` being an aware datetime. Used by agents and tooling.
+    """
+    types = {}
+    times = array("q")
+    values = array("d")
+    type_indexes = array("H")
+    for time, metric_type, value, unit in points:
+        type_index = types.setdefault((metric_type, unit), len(types))
+        times.append((time - _EPOCH) // timedelta(milliseconds=1))
+        values.append(value)
+        type_indexes.append(type_index)
+
+    parts = [FRAME_MAGIC, device_id.bytes, _U16.pack(len(types))]
+    for metric_type, unit in types:
+        for text in (metric_type, unit or ""):
+            encoded = text.encode("utf-8")
+            parts.append(_U8.pack(len(encoded)) + encoded)
+    parts.append(_U32.pack(len(times)))
+    for column in (times, values, type_indexes):
+        if not _LITTLE_ENDIAN:
+            column.byteswap()
+        parts.append(column.tobytes())
+
+    frame = b"".join(parts)
+    return _U32.pack(len(frame)) + frame
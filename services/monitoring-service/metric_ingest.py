@@ -0,0 +1,85 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from schemas import DeviceMetricCreate
+
+# (time, device_id, metric_type, value, unit) - the column order of device_metrics
+MetricPoint = Tuple[datetime, uuid.UUID, str, float, Optional[str]]
+
+
+def parse_metric(row: Any, now: datetime) -> MetricPoint:
+    """Validate one incoming metric; raises ValueError with a short reason"""
+    try:
+        metric = DeviceMetricCreate(**row)
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+    except TypeError:
+        raise ValueError("metric must be an object")
+    return metric_point(metric, now)
+
+
+def metric_point(metric: DeviceMetricCreate, now: datetime) -> MetricPoint:
+    """Row tuple for a validated metric; a missing time means ``now``, naive times are UTC"""
+    point_time = metric.time or now
+    if point_time.tzinfo is None:
+        point_time = point_time.replace(tzinfo=timezone.utc)
+    return (point_time, metric.device_id, metric.metric_type, metric.value, metric.unit)
+
+
+class MetricBatch:
+    """
+    Validated points waiting to be written together, each remembered with
+    the caller's index (array position or line number) for error reporting.
+    Points repeated within the batch are rejected up front because COPY and
+    ON CONFLICT cannot both touch the same key in one statement.
+    """
+
+    def __init__(self):
+        self.points: List[MetricPoint] = []
+        self.indexes: List[int] = []
+        self.rejected: List[Dict[str, Any]] = []
+        self._seen = set()
+
+    def __len__(self):
+        return len(self.points)
+
+    def add(self, index: int, row: Any, now: datetime):
+        try:
+            point = parse_metric(row, now)
+        except ValueError as e:
+            self.reject(index, str(e))
+            return
+        self.add_point(index, point)
+
+    def add_point(self, index: int, point: MetricPoint):
+        key = point[:3]
+        if key in self._seen:
+            self.reject(index, "duplicate point in batch")
+            return
+        self._seen.add(key)
+        self.append(index, point)
+
+    def append(self, index: int, point: MetricPoint):
+        """Add a point the caller has already checked for in-batch duplicates"""
+        self.points.append(point)
+        self.indexes.append(index)
+
+    def reject(self, index: int, error: str):
+        self.rejected.append({"index": index, "error": error})
+
+    def reject_types(self, reasons: Dict[Tuple[str, Optional[str]], str]):
+        """Reject every point whose (metric_type, unit) has a reason in ``reasons``"""
+        if not reasons:
+            return
+        points, indexes = [], []
+        for index, point in zip(self.indexes, self.points):
+            reason = reasons.get((point[2], point[4]))
+            if reason is None:
+                points.append(point)
+                indexes.append(index)
+            else:
+                self.reject(index, reason)
+        self.points, self.indexes = points, indexes
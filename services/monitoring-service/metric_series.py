@@ -0,0 +1,86 @@
+from typing import Any, Dict, List, Sequence
+
+# Rows returned by MonitoringService.query_metrics, ordered by time
+MetricRows = List[Dict[str, Any]]
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets: indexes of ``threshold`` points that keep
+    the visual shape of the series. The first and last points are always
+    kept; every bucket in between contributes the point forming the largest
+    triangle with the previously kept point and the next bucket's average.
+    """
+    count = len(xs)
+    if threshold >= count or count <= 2:
+        return list(range(count))
+    if threshold <= 2:
+        return [0, count - 1][:max(threshold, 1)]
+
+    every = (count - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_start = end
+        next_end = min(int((bucket + 2) * every) + 1, count)
+
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = start
+        for index in range(start, end):
+            area = abs((ax - avg_x) * (ys[index] - ay) - (ax - xs[index]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = index
+        selected.append(best)
+        a = best
+    selected.append(count - 1)
+    return selected
+
+
+def split_series(metrics: MetricRows) -> Dict[tuple, MetricRows]:
+    """Group rows by (device_id, metric_type, unit), keeping time order within each"""
+    series: Dict[tuple, MetricRows] = {}
+    for metric in metrics:
+        series.setdefault((metric["device_id"], metric["metric_type"], metric["unit"]), []).append(metric)
+    return series
+
+
+def downsample_metrics(metrics: MetricRows, points: int) -> MetricRows:
+    """Reduce every series to at most ``points`` rows with LTTB"""
+    downsampled = []
+    for rows in split_series(metrics).values():
+        if len(rows) > points:
+            xs = [row["time"].timestamp() for row in rows]
+            ys = [row["value"] for row in rows]
+            rows = [rows[index] for index in lttb_indices(xs, ys, points)]
+        downsampled.extend(rows)
+    downsampled.sort(key=lambda row: row["time"])
+    return downsampled
+
+
+def columnar_metrics(metrics: MetricRows) -> List[Dict[str, Any]]:
+    """
+    One entry per series with parallel arrays: ``t`` in epoch milliseconds
+    and ``v``, plus ``min``/``max`` for rolled-up rows.
+    """
+    columns = []
+    for (device_id, metric_type, unit), rows in split_series(metrics).items():
+        entry = {
+            "device_id": str(device_id),
+            "metric_type": metric_type,
+            "unit": unit,
+            "t": [int(row["time"].timestamp() * 1000) for row in rows],
+            "v": [row["value"] for row in rows],
+        }
+        if "count" in rows[0]:
+            entry["min"] = [row["min"] for row in rows]
+            entry["max"] = [row["max"] for row in rows]
+        columns.append(entry)
+    return columns
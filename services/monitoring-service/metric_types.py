@@ -0,0 +1,136 @@
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import engine
+from models import MetricType
+
+MetricKey = Tuple[str, Optional[str]]  # (metric_type, unit)
+
+METRIC_TYPES_MAX = int(os.getenv("METRIC_TYPES_MAX", "1000"))  # pairs clients may grow the table to
+METRIC_TYPE_PATTERN = re.compile(os.getenv("METRIC_TYPE_PATTERN", r"[A-Za-z][A-Za-z0-9_.\-]{0,63}"))
+METRIC_UNIT_PATTERN = re.compile(r"[^\x00-\x1f\x7f]{1,16}")
+
+
+def invalid_reason(key: MetricKey) -> Optional[str]:
+    """Why a client may not register ``key``, or None if it may"""
+    name, unit = key
+    if not METRIC_TYPE_PATTERN.fullmatch(name):
+        return "invalid metric type name"
+    if unit is not None and not METRIC_UNIT_PATTERN.fullmatch(unit):
+        return "invalid unit"
+    return None
+
+
+class MetricTypeRegistry:
+    """
+    Process-wide cache of the metric_types table.
+
+    Ingest turns (metric_type, unit) pairs into ids and queries turn ids
+    back into names without touching the database once a pair has been
+    seen. Unknown pairs are registered in their own short transaction, so an
+    id is only ever cached after it has been committed and is visible to
+    every other process.
+
+    Pairs sent by clients go through admit(), which only registers names
+    matching METRIC_TYPE_PATTERN while the table holds fewer than
+    METRIC_TYPES_MAX pairs; ids_for() is for pairs the service writes itself.
+    """
+
+    def __init__(self, bind=engine):
+        self.bind = bind
+        self._ids: Dict[MetricKey, int] = {}
+        self._keys: Dict[int, MetricKey] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: MetricKey) -> bool:
+        return key in self._ids
+
+    def ids_for(self, keys: Iterable[MetricKey]) -> Dict[MetricKey, int]:
+        """Ids for every pair in ``keys``, registering the new ones"""
+        missing = {key for key in keys if key not in self._ids}
+        if missing:
+            self._register(missing)
+        return self._ids
+
+    def admit(self, keys: Iterable[MetricKey]) -> Dict[MetricKey, str]:
+        """
+        Register the new client-supplied pairs in ``keys`` that are valid and
+        fit under METRIC_TYPES_MAX; returns the reason for each one refused
+        """
+        missing = {key for key in keys if key not in self._ids}
+        if not missing:
+            return {}
+        refused = {}
+        for key in missing:
+            reason = invalid_reason(key)
+            if reason is not None:
+                refused[key] = reason
+        allowed = missing - refused.keys()
+        if allowed:
+            self._register(allowed, METRIC_TYPES_MAX)
+            for key in allowed:
+                if key not in self._ids:
+                    refused[key] = "metric type limit reached"
+        return refused
+
+    def key_for(self, type_id: int) -> MetricKey:
+        """(metric_type, unit) for an id stored in device_metrics"""
+        key = self._keys.get(type_id)
+        if key is None:
+            # Registered by another process since we last looked
+            self.refresh()
+            key = self._keys[type_id]
+        return key
+
+    def ids_named(self, name: str) -> List[int]:
+        """Ids of every unit a metric type has been stored with"""
+        ids = [type_id for (type_name, _), type_id in self._ids.items() if type_name == name]
+        if not ids:
+            self.refresh()
+            ids = [type_id for (type_name, _), type_id in self._ids.items() if type_name == name]
+        return ids
+
+    def refresh(self):
+        with self.bind.connect() as conn:
+            rows = conn.execute(select(MetricType.id, MetricType.name, MetricType.unit)).all()
+        with self._lock:
+            self._load(rows)
+
+    def _register(self, keys: Iterable[MetricKey], limit: Optional[int] = None):
+        """Insert the pairs not yet in the table, only while it holds fewer than ``limit``"""
+        with self._lock:
+            with self.bind.begin() as conn:
+                rows = conn.execute(select(MetricType.id, MetricType.name, MetricType.unit)).all()
+                known = {(name, unit) for _, name, unit in rows}
+                new = sorted((key for key in keys if key not in known), key=lambda key: (key[0], key[1] or ""))
+                if limit is not None:
+                    new = new[:max(0, limit - len(rows))]
+                if new:
+                    conn.execute(
+                        pg_insert(MetricType)
+                        .values([{"name": name, "unit": unit} for name, unit in new])
+                        .on_conflict_do_nothing()
+                    )
+                    rows = conn.execute(select(MetricType.id, MetricType.name, MetricType.unit)).all()
+            self._load(rows)
+
+    def _load(self, rows):
+        # Readers never take the lock, so swap in complete dicts
+        self._ids = {(name, unit): type_id for type_id, name, unit in rows}
+        self._keys = {type_id: (name, unit) for type_id, name, unit in rows}
+
+
+_metric_types: Optional[MetricTypeRegistry] = None
+
+
+def get_metric_types() -> MetricTypeRegistry:
+    """Return the process-wide metric type registry"""
+    global _metric_types
+    if _metric_types is None:
+        _metric_types = MetricTypeRegistry()
+    return _metric_types
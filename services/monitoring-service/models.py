@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Float, ForeignKey
+from sqlalchemy import Column, String, DateTime, Float, ForeignKey, SmallInteger, Identity, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
@@ -9,9 +9,44 @@ from database import Base
 class DeviceMetric(Base):
     __tablename__ = "device_metrics"
 
-    # Composite primary key for time-series data
+    # Composite primary key for time-series data. The 2-byte type id comes
+    # last so the row needs no alignment padding after it.
     time = Column(DateTime(timezone=True), primary_key=True)
     device_id = Column(UUID(as_uuid=True), primary_key=True)
-    metric_type = Column(String, primary_key=True, nullable=False)  # cpu, memory, network, ping
     value = Column(Float, nullable=False)
+    metric_type_id = Column(SmallInteger, primary_key=True, nullable=False)  # metric_types.id
+
+
+class MetricType(Base):
+    """
+    Registry of metric type name/unit pairs, so device_metrics rows carry a
+    small-integer id instead of repeating both strings.
+    """
+    __tablename__ = "metric_types"
+
+    id = Column(SmallInteger, Identity(), primary_key=True)
+    name = Column(String, nullable=False)  # cpu, memory, network, ping
     unit = Column(String)  # %, MB, ms, etc.
+
+    __table_args__ = (
+        Index("ix_metric_types_name_unit", name, func.coalesce(unit, ""), unique=True),
+    )
+
+
+class Device(Base):
+    """
+    The device service's ``devices`` table. Monitoring sweeps read the fleet
+    and write back status/last_seen directly in the shared database.
+    """
+    __tablename__ = "devices"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    organization_id = Column(UUID(as_uuid=True), nullable=False)
+    name = Column(String, nullable=False)
+    ip_address = Column(String, nullable=False)
+    device_type = Column(String, nullable=False)  # router, switch, server, etc.
+    location = Column(String)
+    status = Column(String, default="unknown")  # online, offline, unknown
+    last_seen = Column(DateTime(timezone=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
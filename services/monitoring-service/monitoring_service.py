@@ -1,72 +1,724 @@
 import asyncio
-import subprocess
-import platform
-from datetime import datetime
+import csv
+import io
+import json
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import String, cast, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-from app.models import models
-from app.services.device_service import DeviceService
+from database import SessionLocal
+from models import Device, DeviceMetric
+from metric_ingest import MetricBatch, MetricPoint
+from metric_types import get_metric_types
+from metric_cache import from_micros, get_metric_cache
+from rollups import ROLLUPS_BY_NAME, select_rollup
+from metric_frame import decode_metric_frames
+from icmp import ProbeResult, get_pinger
+from probe_backends import ProbeBackend, get_probe_backend
+from sweep_scheduler import SweepScheduler, subnet_key
+from sharding import get_ring
+from probe_scheduler import AdaptiveProbeScheduler, get_probe_scheduler
+from probe_cache import get_probe_cache, status_entry
+from device_snapshot import get_device_snapshot
+from ws_backplane import get_backplane, status_change_event
+
+SWEEP_PACING_KEY = os.getenv("SWEEP_PACING_KEY", "subnet")  # subnet or location
+LAST_SEEN_REFRESH_INTERVAL = int(os.getenv("LAST_SEEN_REFRESH_INTERVAL", "300"))  # seconds
+METRICS_INSERT_CHUNK = 5000  # rows per multi-row INSERT statement
+METRICS_STREAM_FLUSH_ROWS = int(os.getenv("METRICS_STREAM_FLUSH_ROWS", "5000"))
+METRICS_STREAM_FLUSH_INTERVAL = float(os.getenv("METRICS_STREAM_FLUSH_INTERVAL", "1.0"))  # seconds
+METRICS_STREAM_MAX_LINE = int(os.getenv("METRICS_STREAM_MAX_LINE", "65536"))  # bytes
+METRICS_STREAM_MAX_REJECTIONS = 1000  # rejections reported in detail; the rest are only counted
+METRICS_EXPORT_BATCH = int(os.getenv("METRICS_EXPORT_BATCH", "5000"))  # rows fetched per server-side cursor round trip
+
+
+_logged_probe_errors = set()  # exception types already reported by log_probe_error
+
+
+def log_probe_error(ip_address: str, error: Exception):
+    """Print the first probe failure of each kind; later ones would repeat it for every device"""
+    kind = type(error).__name__
+    if kind not in _logged_probe_errors:
+        _logged_probe_errors.add(kind)
+        print(f"Probe error for {ip_address} ({kind}: {error}); further {kind} errors are not logged")
+
+
+def last_seen_is_stale(last_seen: Optional[datetime], now: datetime) -> bool:
+    return last_seen is None or last_seen < now - timedelta(seconds=LAST_SEEN_REFRESH_INTERVAL)
 
 
 class MonitoringService:
-    def __init__(self, db: Session):
+    def __init__(
+        self,
+        db: Optional[Session],
+        probe_backend: Optional[ProbeBackend] = None,
+        sweep_scheduler: Optional[SweepScheduler] = None,
+    ):
+        # None for the timing wheel, which opens a session per database step
         self.db = db
-        self.device_service = DeviceService(self.db)
+        self.probe_backend = probe_backend or get_probe_backend()
+        self.sweep_scheduler = sweep_scheduler or SweepScheduler()
+
+    def get_devices(self, shard: Optional[int] = None, shard_count: int = 1) -> List[Any]:
+        """
+        Load the fields a sweep needs for every device as plain rows, or
+        with ``shard`` set only for the devices the consistent hash ring
+        assigns to it, filtered in SQL.
+        Rows are not tracked by the session, so a sweep never flushes
+        per-device UPDATEs behind our back.
+        """
+        query = select(
+            Device.id,
+            Device.organization_id,
+            Device.ip_address,
+            Device.device_type,
+            Device.location,
+            Device.status,
+            Device.last_seen,
+        )
+        if shard is not None:
+            query = query.where(get_ring(shard_count).shard_clause(shard))
+        return self.db.execute(query).all()
+
+    def organization_devices(self, organization_id: Any, device_ids: List[uuid.UUID]) -> List[uuid.UUID]:
+        """The subset of ``device_ids`` that belongs to the organization"""
+        return list(self.db.execute(
+            select(Device.id)
+            .where(Device.organization_id == organization_id)
+            .where(Device.id.in_(device_ids))
+        ).scalars())
 
     async def ping_device(self, ip_address: str) -> bool:
         """Ping a device to check if it's online"""
         try:
-            # Different ping commands for different OS
-            param = "-n" if platform.system().lower() == "windows" else "-c"
-            command = ["ping", param, "1", ip_address]
-            
-            result = subprocess.run(command, capture_output=True, text=True, timeout=5)
-            return result.returncode == 0
-        except Exception:
+            rtt = await get_pinger().ping(ip_address)
+            return rtt is not None
+        except Exception as e:
+            log_probe_error(ip_address, e)
             return False
 
-    async def check_device_status(self, device: models.Device) -> models.Device | None:
+    async def probe_device(self, ip_address: str) -> Optional[ProbeResult]:
+        """Send a burst of echoes to a device; None if the probe itself failed"""
+        try:
+            return await self.probe_backend.probe(ip_address)
+        except Exception as e:
+            log_probe_error(ip_address, e)
+            return None
+
+    def _pacing_key(self, device) -> str:
+        """Token bucket group for a device: its /24 subnet, or its site"""
+        if SWEEP_PACING_KEY == "location" and device.location:
+            return device.location
+        return subnet_key(device.ip_address)
+
+    def metric_rows(self, device: Any, result: ProbeResult, now: datetime) -> List[Dict[str, Any]]:
+        """device_metrics rows for one probe burst: RTT min/avg/max, loss and jitter"""
+        values = [
+            ("ping", result.rtt_avg, "ms"),
+            ("ping_min", result.rtt_min, "ms"),
+            ("ping_max", result.rtt_max, "ms"),
+            ("jitter", result.jitter, "ms"),
+            ("packet_loss", result.packet_loss, "%"),
+        ]
+        type_ids = get_metric_types().ids_for((metric_type, unit) for metric_type, _, unit in values)
+        return [
+            {"time": now, "device_id": device.id, "value": value, "metric_type_id": type_ids[(metric_type, unit)]}
+            for metric_type, value, unit in values
+            if value is not None
+        ]
+
+    def write_sweep_results(
+        self,
+        devices: List[Any],
+        statuses: Dict[int, str],
+        results: Optional[Dict[int, ProbeResult]] = None,
+    ) -> List[Dict[str, Any]]:
         """
-        Check the status of a single device.
-        Returns the device if status changed, otherwise None.
+        Apply a whole sweep's outcome in one transaction.
+
+        Status changes go out as a single executemany UPDATE keyed by primary
+        key. Devices that stayed online only get ``last_seen`` bumped once it
+        is older than LAST_SEEN_REFRESH_INTERVAL, as one ``UPDATE ... WHERE id
+        IN (...)``. Probe latency metrics are inserted as one executemany
+        INSERT. Status changes are published to WebSocket subscribers once
+        committed, and every probed device's status is shared with the probe
+        cache of each replica. Devices missing from ``statuses`` were not probed and are
+        left untouched. Returns the status changes.
         """
-        is_online = await self.ping_device(device.ip_address)
-        new_status = "online" if is_online else "offline"
+        now = datetime.now(timezone.utc)
 
-        if device.status != new_status:
-            device.status = new_status
-            device.last_seen = datetime.utcnow()
-            self.db.commit()
-            self.db.refresh(device)
-            return device
-        
-        if is_online:
-            device.last_seen = datetime.utcnow()
+        changes = []
+        events = []
+        seen_ids = []
+        metrics = []
+        for index, device in enumerate(devices):
+            new_status = statuses.get(index)
+            if new_status is None:
+                continue
+            if device.status != new_status:
+                changes.append({"id": device.id, "status": new_status, "last_seen": now})
+                events.append(status_change_event(device.organization_id, device.id, device.device_type, new_status, now))
+            elif new_status == "online" and last_seen_is_stale(device.last_seen, now):
+                seen_ids.append(device.id)
+            if results and index in results:
+                metrics.extend(self.metric_rows(device, results[index], now))
+
+        if changes:
+            self.db.execute(update(Device), changes)
+        if seen_ids:
+            self.db.execute(
+                update(Device)
+                .where(Device.id.in_(seen_ids))
+                .values(last_seen=now)
+                .execution_options(synchronize_session=False)
+            )
+        if metrics:
+            self.db.execute(insert(DeviceMetric), metrics)
+        if changes or seen_ids or metrics:
             self.db.commit()
+        device_snapshot = get_device_snapshot()
+        entries = []
+        for index, device in enumerate(devices):
+            status = statuses.get(index)
+            if status is None:
+                continue
+            result = results.get(index) if results else None
+            device_snapshot.record(device.id, status, result.rtt_avg if result else None, now if status == "online" else None)
+            entries.append(status_entry(device.id, device.organization_id, device.ip_address, status, now))
+        # Lets the status endpoint on any replica answer from this sweep
+        get_probe_cache().share(entries)
+        if metrics:
+            get_metric_cache().add(
+                (metric["device_id"], metric["time"], metric["metric_type_id"], metric["value"]) for metric in metrics
+            )
+        # Reaches /ws subscribers on every replica, including sweeps run by Celery workers
+        get_backplane().publish_events(events)
 
-        return None
+        return [
+            {"device_id": str(change["id"]), "status": change["status"], "timestamp": now.isoformat()}
+            for change in changes
+        ]
 
-    async def monitor_all_devices(self) -> List[models.Device]:
+    async def monitor_all_devices(self, shard: Optional[int] = None, shard_count: int = 1) -> Dict[str, Any]:
         """
         Monitor all devices and update their status.
-        Returns a list of devices whose status has changed.
+        With ``shard`` set, only the devices the consistent hash ring assigns
+        to that shard are probed.
+        Probes are paced by the sweep scheduler; devices whose probe misses the
+        sweep deadline or fails keep their stored status and are reported as
+        unprobed.
+        Returns the status changes of this sweep and the unprobed device ids.
+        """
+        devices = self.get_devices(shard, shard_count)
+        statuses, results = await self._probe(devices)
+        return {
+            "status_changes": self.write_sweep_results(devices, statuses, results),
+            "unprobed": [str(device.id) for index, device in enumerate(devices) if index not in statuses],
+        }
+
+    async def _probe(self, devices: List[Any]) -> Tuple[Dict[int, str], Dict[int, ProbeResult]]:
+        """
+        Probe devices through the sweep scheduler; returns status and probe
+        result by index, leaving out devices that were not probed
+        """
+        sweep = await self.sweep_scheduler.run(
+            devices,
+            probe=lambda device: self.probe_device(device.ip_address),
+            group_key=self._pacing_key,
+        )
+        if sweep.timed_out:
+            print(f"Monitoring sweep deadline hit: {len(sweep.timed_out)} of {len(devices)} devices unprobed")
+
+        statuses = {}
+        results = {}
+        for index in range(len(devices)):
+            result = sweep.results.get(index)
+            if result is not None:
+                statuses[index] = "online" if result.is_alive else "offline"
+                results[index] = result
+        return statuses, results
+
+    async def _in_session(self, work, *args):
+        """
+        Run ``work(service, *args)`` in the threadpool against a fresh
+        session, rolled back on error and always closed, so database round
+        trips never block the event loop and one failure never poisons the
+        next tick
+        """
+        def run():
+            db = SessionLocal()
+            try:
+                return work(MonitoringService(db, self.probe_backend, self.sweep_scheduler), *args)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        return await run_in_threadpool(run)
+
+    async def _probe_due(self, scheduler: AdaptiveProbeScheduler, due: List[Any]):
+        """Probe one tick's worth of due devices and reschedule them"""
+        try:
+            statuses, results = await self._probe(due)
+            await self._in_session(MonitoringService.write_sweep_results, due, statuses, results)
+        except Exception as e:
+            # Unwritten results would hide the change from the next write and
+            # serve the old status as fresh, so treat the tick as unprobed
+            print(f"Monitoring error: {e}")
+            statuses = {}
+
+        now = datetime.now(timezone.utc)
+        probe_cache = get_probe_cache()
+        for index, state in enumerate(due):
+            new_status = statuses.get(index)
+            if new_status is None:
+                # Not probed or not stored this time: keep what we knew and try again on schedule
+                scheduler.record(state, state.status)
+                continue
+            probe_cache.put(
+                str(state.id),
+                status_entry(state.id, state.organization_id, state.ip_address, new_status, now),
+            )
+            if state.status != new_status or (new_status == "online" and last_seen_is_stale(state.last_seen, now)):
+                state.last_seen = now
+            scheduler.record(state, new_status)
+
+    def _metric_type_ids(self, metric_types: Optional[List[str]]) -> Optional[List[int]]:
+        """Registry ids for the named types; None means all types, [] that none was ever stored"""
+        if not metric_types:
+            return None
+        metric_type_registry = get_metric_types()
+        return [type_id for name in metric_types for type_id in metric_type_registry.ids_named(name)]
+
+    def _resolution(
+        self,
+        device_uuids: List[uuid.UUID],
+        type_ids: Optional[List[int]],
+        start_time: datetime,
+        end_time: Optional[datetime],
+        max_points: Optional[int],
+        cached: Optional[Dict[uuid.UUID, list]] = None,
+    ) -> str:
+        """
+        Raw points qualify when each series (one device and metric type)
+        has at most ``max_points`` in the window. That is counted per series
+        in the hot cache when it covers every device; otherwise the window
+        may hold ``max_points`` times the number of series, counted with a
+        query that stops one row past that. Failing that, the finest rollup
+        that fits is used.
+        """
+        if not max_points or type_ids == []:
+            return "raw"
+        if cached is None:
+            cached = self._cached_metrics(device_uuids, type_ids, start_time, end_time)
+        if len(cached) == len(device_uuids):
+            counts = Counter((device_uuid, point[2]) for device_uuid, points in cached.items() for point in points)
+            if max(counts.values(), default=0) <= max_points:
+                return "raw"
+        else:
+            limit = max_points * self._series_count(device_uuids, type_ids, start_time, end_time)
+            probe = (self._raw_metrics_query(device_uuids, type_ids, start_time, end_time)
+                     .with_only_columns(DeviceMetric.time)
+                     .limit(limit + 1)
+                     .subquery())
+            if self.db.execute(select(func.count()).select_from(probe)).scalar() <= limit:
+                return "raw"
+        span = (end_time or datetime.now(timezone.utc)) - start_time
+        return select_rollup(span.total_seconds(), max_points).name
+
+    def _series_count(
+        self,
+        device_uuids: List[uuid.UUID],
+        type_ids: Optional[List[int]],
+        start_time: datetime,
+        end_time: Optional[datetime],
+    ) -> int:
+        """
+        Series with data in the window, read from the 1h rollup, which holds
+        a few rows per series; at least one per device
+        """
+        table = ROLLUPS_BY_NAME["1h"].table
+        query = (select(table.c.device_id, table.c.metric_type_id)
+                 .where(table.c.device_id.in_(device_uuids))
+                 .where(table.c.bucket > start_time - timedelta(hours=1)))
+        if end_time is not None:
+            query = query.where(table.c.bucket < end_time)
+        if type_ids is not None:
+            query = query.where(table.c.metric_type_id.in_(type_ids))
+        series = self.db.execute(select(func.count()).select_from(query.distinct().subquery())).scalar()
+        return max(series, len(device_uuids))
+
+    def _cached_metrics(
+        self,
+        device_uuids: List[uuid.UUID],
+        type_ids: Optional[List[int]],
+        start_time: datetime,
+        end_time: Optional[datetime],
+    ) -> Dict[uuid.UUID, list]:
+        """Raw points of the devices the hot metric cache fully covers for the window"""
+        metric_cache = get_metric_cache()
+        cached = {}
+        for device_uuid in device_uuids:
+            points = metric_cache.get(device_uuid, type_ids, start_time, end_time)
+            if points is not None:
+                cached[device_uuid] = points
+        return cached
+
+    def _raw_metrics_query(
+        self,
+        device_uuids: List[uuid.UUID],
+        type_ids: Optional[List[int]],
+        start_time: datetime,
+        end_time: Optional[datetime],
+    ):
+        query = (select(DeviceMetric.device_id, DeviceMetric.time, DeviceMetric.value, DeviceMetric.metric_type_id)
+                 .where(DeviceMetric.device_id.in_(device_uuids))
+                 .where(DeviceMetric.time >= start_time))
+        if end_time is not None:
+            query = query.where(DeviceMetric.time < end_time)
+        if type_ids is not None:
+            query = query.where(DeviceMetric.metric_type_id.in_(type_ids))
+        return query
+
+    def query_metrics(
+        self,
+        device_uuids: List[uuid.UUID],
+        metric_types: Optional[List[str]],
+        start_time: datetime,
+        end_time: Optional[datetime] = None,
+        max_points: Optional[int] = None,
+        resolution: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Metrics of many devices in one query, ordered by device and time;
+        ``end_time`` None leaves the window open. Returns the rows and the
+        resolution they were read at.
+        """
+        type_ids = self._metric_type_ids(metric_types)
+        cached = {}
+        if resolution in (None, "raw") and type_ids != []:
+            cached = self._cached_metrics(device_uuids, type_ids, start_time, end_time)
+        if resolution is None:
+            resolution = self._resolution(device_uuids, type_ids, start_time, end_time, max_points, cached)
+        if type_ids == [] or not device_uuids:
+            return [], resolution
+
+        metric_type_registry = get_metric_types()
+        metrics = []
+        if resolution in ROLLUPS_BY_NAME:
+            table = ROLLUPS_BY_NAME[resolution].table
+            # Include the bucket the window starts in
+            query = (select(table.c.device_id, table.c.bucket, table.c.metric_type_id, table.c.value_min,
+                            table.c.value_max, table.c.value_sum, table.c.value_count)
+                     .where(table.c.device_id.in_(device_uuids))
+                     .where(table.c.bucket > start_time - timedelta(seconds=ROLLUPS_BY_NAME[resolution].seconds)))
+            if end_time is not None:
+                query = query.where(table.c.bucket < end_time)
+            if type_ids is not None:
+                query = query.where(table.c.metric_type_id.in_(type_ids))
+            rows = self.db.execute(query.order_by(table.c.device_id, table.c.bucket))
+            for device_id, bucket, type_id, value_min, value_max, value_sum, value_count in rows:
+                name, unit = metric_type_registry.key_for(type_id)
+                metrics.append({
+                    "time": bucket,
+                    "device_id": device_id,
+                    "metric_type": name,
+                    "value": value_sum / value_count,
+                    "unit": unit,
+                    "min": value_min,
+                    "max": value_max,
+                    "count": value_count,
+                })
+        else:
+            # Devices the hot cache covers for this window never touch the database
+            rows = []
+            missing = [device_uuid for device_uuid in device_uuids if device_uuid not in cached]
+            if missing:
+                query = self._raw_metrics_query(missing, type_ids, start_time, end_time)
+                rows = self.db.execute(query.order_by(DeviceMetric.device_id, DeviceMetric.time)).all()
+            for device_uuid, points in cached.items():
+                rows.extend((device_uuid, from_micros(micros), value, type_id) for micros, value, type_id in points)
+            if cached:
+                rows.sort(key=lambda row: row[0])  # stable, so time order within a device is kept
+            for device_id, point_time, value, type_id in rows:
+                name, unit = metric_type_registry.key_for(type_id)
+                metrics.append({"time": point_time, "device_id": device_id, "metric_type": name, "value": value, "unit": unit})
+        return metrics, resolution
+
+    def iter_metrics(
+        self,
+        device_uuids: List[uuid.UUID],
+        metric_types: Optional[List[str]],
+        start_time: datetime,
+        end_time: Optional[datetime] = None,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Raw metrics ordered by device and time, in batches of
+        METRICS_EXPORT_BATCH rows read through a server-side cursor, so
+        memory stays bounded however long the window is.
+        """
+        type_ids = self._metric_type_ids(metric_types)
+        if type_ids == [] or not device_uuids:
+            return
+        # Device ids as text skip building a UUID per row; rows go straight
+        # through the Core connection rather than the ORM result layer
+        query = (self._raw_metrics_query(device_uuids, type_ids, start_time, end_time)
+                 .with_only_columns(cast(DeviceMetric.device_id, String), DeviceMetric.time,
+                                    DeviceMetric.value, DeviceMetric.metric_type_id)
+                 .order_by(DeviceMetric.device_id, DeviceMetric.time)
+                 .execution_options(yield_per=METRICS_EXPORT_BATCH))
+        metric_type_registry = get_metric_types()
+        for rows in self.db.connection().execute(query).partitions():
+            batch = []
+            for device_id, point_time, value, type_id in rows:
+                name, unit = metric_type_registry.key_for(type_id)
+                batch.append({"time": point_time, "device_id": device_id, "metric_type": name, "value": value, "unit": unit})
+            yield batch
+
+    def ingest_metric_batch(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Validate and store a batch of metric points.
+        Invalid rows and points that already exist are rejected individually;
+        the rest are written in one transaction.
+        """
+        now = datetime.now(timezone.utc)
+        batch = MetricBatch()
+        for index, row in enumerate(rows):
+            batch.add(index, row, now)
+
+        accepted, rejected = self.write_metric_batch(batch)
+        rejected.sort(key=lambda rejection: rejection["index"])
+        return {"accepted": accepted, "rejected": rejected}
+
+    def ingest_metric_frames(self, body: bytes, max_points: int) -> Dict[str, Any]:
+        """
+        Store the points of a binary columnar metric body (see metric_frame).
+        Raises ValueError if the body is malformed; otherwise rejections are
+        reported by point position, as for ingest_metric_batch.
+        """
+        batch = MetricBatch()
+        decode_metric_frames(body, batch, max_points)
+        accepted, rejected = self.write_metric_batch(batch)
+        rejected.sort(key=lambda rejection: rejection["index"])
+        return {"accepted": accepted, "rejected": rejected}
+
+    def write_metric_batch(self, batch: MetricBatch) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Commit a batch; returns the number stored and the batch's rejections.
+        Points of metric types the registry refuses to add are rejected.
+        """
+        batch.reject_types(get_metric_types().admit({(point[2], point[4]) for point in batch.points}))
+        duplicates = self.bulk_insert_metrics(batch.points)
+        self.db.commit()
+        self._cache_points(batch.points, duplicates)
+        for position in duplicates:
+            batch.reject(batch.indexes[position], "point already exists")
+        return len(batch.points) - len(duplicates), batch.rejected
+
+    async def ingest_metric_stream(self, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Ingest newline-delimited JSON metrics as the body arrives.
+
+        Lines are parsed incrementally and written in group commits of
+        METRICS_STREAM_FLUSH_ROWS points, or every METRICS_STREAM_FLUSH_INTERVAL
+        seconds, so memory stays bounded however long the stream runs.
+        Rejections are reported by 1-based line number.
         """
-        devices = self.device_service.get_devices()
-        
-        tasks = [self.check_device_status(device) for device in devices]
-        results = await asyncio.gather(*tasks)
-        
-        # Filter out None results to get only updated devices
-        updated_devices = [res for res in results if res is not None]
-        return updated_devices
+        result = {"accepted": 0, "rejected_count": 0, "rejected": []}
+        batch = MetricBatch()
+        last_flush = time.monotonic()
+
+        def collect(rejections: List[Dict[str, Any]]):
+            result["rejected_count"] += len(rejections)
+            room = METRICS_STREAM_MAX_REJECTIONS - len(result["rejected"])
+            result["rejected"].extend(rejections[:max(0, room)])
+
+        async def flush():
+            nonlocal batch, last_flush
+            accepted, rejections = await run_in_threadpool(self.write_metric_batch, batch)
+            result["accepted"] += accepted
+            collect(rejections)
+            batch = MetricBatch()
+            last_flush = time.monotonic()
+
+        def handle(line_number: int, line: bytes, now: datetime):
+            line = line.strip()
+            if not line:
+                return
+            try:
+                row = json.loads(line)
+            except ValueError:
+                batch.reject(line_number, "invalid JSON")
+                return
+            batch.add(line_number, row, now)
+
+        async def handle_chunk(chunk: bytes):
+            nonlocal pending, line_number, discarding
+            now = datetime.now(timezone.utc)
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                line_number += 1
+                if discarding:
+                    # Tail of an over-long line whose head was already dropped
+                    discarding = False
+                    batch.reject(line_number, "line too long")
+                else:
+                    handle(line_number, line, now)
+            if len(pending) > METRICS_STREAM_MAX_LINE:
+                discarding = True
+                pending = b""
+
+            if len(batch) >= METRICS_STREAM_FLUSH_ROWS or (
+                len(batch) and time.monotonic() - last_flush >= METRICS_STREAM_FLUSH_INTERVAL
+            ):
+                await flush()
+
+        pending = b""
+        line_number = 0
+        discarding = False
+        chunk_iterator = chunks.__aiter__()
+        next_chunk: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if next_chunk is None:
+                    next_chunk = asyncio.ensure_future(chunk_iterator.__anext__())
+                timeout = None
+                if len(batch):
+                    timeout = max(0.0, last_flush + METRICS_STREAM_FLUSH_INTERVAL - time.monotonic())
+                # Waiting on the read instead of wait_for() keeps it running
+                # through the flush, where a timeout would cancel it
+                done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+                if not done:
+                    await flush()  # the client went quiet with points waiting
+                    continue
+                read, next_chunk = next_chunk, None
+                try:
+                    chunk = read.result()
+                except StopAsyncIteration:
+                    break
+                await handle_chunk(chunk)
+        finally:
+            if next_chunk is not None:
+                next_chunk.cancel()
+
+        if discarding:
+            batch.reject(line_number + 1, "line too long")
+        elif pending:
+            handle(line_number + 1, pending, datetime.now(timezone.utc))
+        await flush()
+
+        result["rejected"].sort(key=lambda rejection: rejection["index"])
+        return result
+
+    def bulk_insert_metrics(self, points: List[MetricPoint]) -> List[int]:
+        """
+        Insert metric points in the current transaction.
+
+        On psycopg2 the points are streamed with COPY. If that fails, usually
+        because some points already exist, the batch is retried as multi-row
+        ``INSERT ... ON CONFLICT DO NOTHING``. Returns the positions of
+        points that were skipped as already present.
+        """
+        if not points:
+            return []
+
+        if self.db.get_bind().dialect.driver == "psycopg2":
+            savepoint = self.db.begin_nested()
+            try:
+                self._copy_metrics(points)
+                savepoint.commit()
+                return []
+            except Exception:
+                # COPY is all-or-nothing; fall back to the per-row conflict path
+                savepoint.rollback()
+
+        return self._insert_metrics(points)
+
+    def _cache_points(self, points: List[MetricPoint], duplicates: List[int]):
+        """Add committed points to the hot metric cache, leaving out those that were not stored"""
+        metric_cache = get_metric_cache()
+        if not metric_cache.enabled or not points:
+            return
+        type_ids = get_metric_types().ids_for({(point[2], point[4]) for point in points})
+        skipped = set(duplicates)
+        metric_cache.add(
+            (device_id, point_time, type_ids[(metric_type, unit)], value)
+            for position, (point_time, device_id, metric_type, value, unit) in enumerate(points)
+            if position not in skipped
+        )
+
+    def _copy_metrics(self, points: List[MetricPoint]):
+        type_ids = get_metric_types().ids_for({(point[2], point[4]) for point in points})
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for point_time, device_id, metric_type, value, unit in points:
+            writer.writerow((point_time.isoformat(), device_id, repr(value), type_ids[(metric_type, unit)]))
+        buffer.seek(0)
+
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY device_metrics (time, device_id, value, metric_type_id) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    def _insert_metrics(self, points: List[MetricPoint]) -> List[int]:
+        type_ids = get_metric_types().ids_for({(point[2], point[4]) for point in points})
+        inserted = set()
+        for start in range(0, len(points), METRICS_INSERT_CHUNK):
+            chunk = points[start:start + METRICS_INSERT_CHUNK]
+            statement = (
+                pg_insert(DeviceMetric)
+                .values([
+                    {"time": point_time, "device_id": device_id, "value": value, "metric_type_id": type_ids[(metric_type, unit)]}
+                    for point_time, device_id, metric_type, value, unit in chunk
+                ])
+                .on_conflict_do_nothing()
+                .returning(DeviceMetric.time, DeviceMetric.device_id, DeviceMetric.metric_type_id)
+            )
+            inserted.update(tuple(row) for row in self.db.execute(statement))
+
+        return [
+            position for position, (point_time, device_id, metric_type, _, unit) in enumerate(points)
+            if (point_time, device_id, type_ids[(metric_type, unit)]) not in inserted
+        ]
 
     async def start_monitoring(self, interval: int = 30):
-        """Start continuous monitoring with specified interval in seconds"""
+        """
+        Start continuous monitoring on the timing wheel.
+        Each tick probes only the devices that are due; the device list is
+        re-read every ``interval`` seconds to pick up added and removed devices.
+        """
+        scheduler = get_probe_scheduler()
+        loop = asyncio.get_running_loop()
+        in_flight = set()
+        next_sync = next_tick = loop.time()
         while True:
             try:
-                await self.monitor_all_devices()
-                await asyncio.sleep(interval)
+                if loop.time() >= next_sync:
+                    scheduler.sync(await self._in_session(MonitoringService.get_devices))
+                    next_sync = loop.time() + interval
+
+                due = []
+                # Catch up on ticks missed while the loop was busy
+                while next_tick <= loop.time():
+                    due.extend(scheduler.due())
+                    next_tick += scheduler.wheel.tick
+                if due:
+                    task = asyncio.create_task(self._probe_due(scheduler, due))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
             except Exception as e:
                 print(f"Monitoring error: {e}")
-                await asyncio.sleep(interval)
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
@@ -0,0 +1,119 @@
+import abc
+import asyncio
+import math
+import os
+import random
+import time
+from typing import Dict, Optional, Tuple
+
+from icmp import PING_BURST_INTERVAL, PING_COUNT, PING_TIMEOUT, ProbeResult, get_pinger
+
+PROBE_BACKEND = os.getenv("PROBE_BACKEND", "icmp")  # icmp or simulated
+
+
+class ProbeBackend(abc.ABC):
+    """How the monitoring service reaches a device"""
+
+    @abc.abstractmethod
+    async def probe(self, address: str) -> ProbeResult:
+        """Probe one address and report what came back"""
+
+
+class IcmpProbeBackend(ProbeBackend):
+    """ICMP echo bursts through the shared pinger"""
+
+    async def probe(self, address: str) -> ProbeResult:
+        return await get_pinger().probe(address)
+
+
+class SimulatedProbeBackend(ProbeBackend):
+    """
+    Stand-in for a device fleet that needs no network.
+
+    Every address gets a stable profile derived from ``seed``: a base RTT
+    drawn from a log-normal distribution around ``latency_ms``, a per-echo
+    loss rate, and a chance of being permanently down or flapping (down for
+    the second half of every ``flap_period`` seconds). Probes take as long as
+    the real thing would, including waiting out the timeout for lost echoes,
+    so sweep timings stay realistic.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 20.0,
+        latency_sigma: float = 0.6,
+        jitter_sigma: float = 0.1,
+        loss_rate: float = 0.01,
+        down_rate: float = 0.02,
+        flap_rate: float = 0.01,
+        flap_period: float = 120.0,
+        count: int = PING_COUNT,
+        interval: float = PING_BURST_INTERVAL,
+        timeout: float = PING_TIMEOUT,
+        seed: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.jitter_sigma = jitter_sigma
+        self.loss_rate = loss_rate
+        self.down_rate = down_rate
+        self.flap_rate = flap_rate
+        self.flap_period = flap_period
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        self.seed = seed
+        self._profiles: Dict[str, Tuple[float, str, float]] = {}
+        self._random = random.Random(seed)
+
+    def _profile(self, address: str) -> Tuple[float, str, float]:
+        """(base RTT in ms, "up"/"down"/"flapping", flap phase) for an address"""
+        profile = self._profiles.get(address)
+        if profile is None:
+            rng = random.Random(f"{self.seed}:{address}")
+            base_rtt = self.latency_ms * math.exp(rng.gauss(0, self.latency_sigma))
+            roll = rng.random()
+            if roll < self.down_rate:
+                behaviour = "down"
+            elif roll < self.down_rate + self.flap_rate:
+                behaviour = "flapping"
+            else:
+                behaviour = "up"
+            profile = self._profiles[address] = (base_rtt, behaviour, rng.random() * self.flap_period)
+        return profile
+
+    def is_up(self, address: str, now: Optional[float] = None) -> bool:
+        _, behaviour, phase = self._profile(address)
+        if behaviour == "flapping":
+            now = time.monotonic() if now is None else now
+            return ((now + phase) % self.flap_period) < self.flap_period / 2
+        return behaviour == "up"
+
+    async def probe(self, address: str) -> ProbeResult:
+        base_rtt, _, _ = self._profile(address)
+        up = self.is_up(address)
+        rtts = []
+        for _ in range(self.count):
+            if up and self._random.random() >= self.loss_rate:
+                rtts.append(base_rtt * math.exp(self._random.gauss(0, self.jitter_sigma)))
+            else:
+                rtts.append(None)
+
+        # The burst ends when the last echo is answered or times out
+        elapsed = max(
+            index * self.interval + (rtt / 1000.0 if rtt is not None else self.timeout)
+            for index, rtt in enumerate(rtts)
+        )
+        await asyncio.sleep(elapsed)
+        return ProbeResult(rtts)
+
+
+_probe_backend: Optional[ProbeBackend] = None
+
+
+def get_probe_backend() -> ProbeBackend:
+    """Return the process-wide probe backend selected by PROBE_BACKEND"""
+    global _probe_backend
+    if _probe_backend is None:
+        _probe_backend = SimulatedProbeBackend() if PROBE_BACKEND == "simulated" else IcmpProbeBackend()
+    return _probe_backend
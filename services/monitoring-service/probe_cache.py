@@ -0,0 +1,197 @@
+import asyncio
+import json
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+PROBE_CACHE_TTL = float(os.getenv("PROBE_CACHE_TTL", "60"))  # seconds
+PROBE_CACHE_MAX_ENTRIES = int(os.getenv("PROBE_CACHE_MAX_ENTRIES", "100000"))
+PROBE_CACHE_SHARED = os.getenv("PROBE_CACHE_SHARED", "redis")  # redis, or none to only keep results in this process
+PROBE_CACHE_KEY_PREFIX = os.getenv("PROBE_CACHE_KEY_PREFIX", "netpulse:probe:")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+
+def status_entry(device_id, organization_id, ip_address: str, status: str, checked_at: datetime) -> Dict[str, Any]:
+    """Cached status of one device, shaped like the status endpoint's response"""
+    return {
+        "device_id": str(device_id),
+        "organization_id": str(organization_id) if organization_id else None,
+        "status": status,
+        "is_online": status == "online",
+        "ip_address": ip_address,
+        "checked_at": checked_at.isoformat(),
+    }
+
+
+def entry_age(entry: Dict[str, Any]) -> float:
+    """Seconds since the entry's probe ran"""
+    return max(0.0, (datetime.now(timezone.utc) - datetime.fromisoformat(entry["checked_at"])).total_seconds())
+
+
+class SharedProbeResults:
+    """
+    Status entries in Redis, one key per device expiring after the cache
+    TTL, so results of sweeps run by Celery workers reach the API replicas'
+    caches. Writes are synchronous, for sweeps; reads are async, for the
+    status endpoint. Redis errors are printed and treated as a miss.
+    """
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = PROBE_CACHE_TTL, prefix: str = PROBE_CACHE_KEY_PREFIX):
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = None
+        self._sync_client = None
+
+    def put_many(self, entries: List[Dict[str, Any]]):
+        if not entries:
+            return
+        if self._sync_client is None:
+            import redis
+
+            self._sync_client = redis.Redis.from_url(self.url, socket_timeout=5)
+        try:
+            pipeline = self._sync_client.pipeline(transaction=False)
+            for entry in entries:
+                pipeline.set(self.prefix + entry["device_id"], json.dumps(entry), ex=math.ceil(self.ttl))
+            pipeline.execute()
+        except Exception as e:
+            print(f"Shared probe cache write error: {e}")
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self._client is None:
+            import redis.asyncio as redis_asyncio
+
+            self._client = redis_asyncio.Redis.from_url(self.url, socket_timeout=1, socket_connect_timeout=1)
+        try:
+            payload = await self._client.get(self.prefix + key)
+        except Exception as e:
+            print(f"Shared probe cache read error: {e}")
+            return None
+        return json.loads(payload) if payload is not None else None
+
+
+class ProbeCache:
+    """
+    TTL cache of recent device probe results with single-flight coalescing:
+    concurrent requests that miss the cache for the same key share one
+    in-flight probe instead of each starting their own.
+
+    With ``shared`` set, a local miss first looks for a result another
+    process wrote there (see share()) before probing.
+    """
+
+    def __init__(
+        self,
+        ttl: float = PROBE_CACHE_TTL,
+        max_entries: int = PROBE_CACHE_MAX_ENTRIES,
+        shared: Optional[SharedProbeResults] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        return value
+
+    def put(self, key: str, value: Dict[str, Any], age: float = 0.0):
+        """Cache ``value``, which was probed ``age`` seconds ago"""
+        # Re-inserting keeps the dict ordered oldest-first for eviction
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() - age, value)
+        if len(self._entries) > self.max_entries:
+            self._evict()
+
+    def share(self, entries: List[Dict[str, Any]]):
+        """Make status entries from a sweep visible to every process's cache"""
+        if self.shared is not None:
+            self.shared.put_many(entries)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, (stored_at, _) in self._entries.items() if now - stored_at > self.ttl]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+    async def get_or_probe(
+        self,
+        key: str,
+        probe: Callable[[], Awaitable[Dict[str, Any]]],
+        fresh: bool = False,
+        flight_key: Optional[Hashable] = None,
+    ) -> Dict[str, Any]:
+        """
+        Return the cached value for ``key`` unless ``fresh`` is set or it has
+        expired, locally or in the shared store; otherwise run ``probe`` once
+        for all concurrent callers that share ``flight_key`` (``key`` by
+        default) and cache its result.
+        """
+        if not fresh:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            if self.shared is not None:
+                cached = await self.shared.get(key)
+                if cached is not None:
+                    age = entry_age(cached)
+                    if age <= self.ttl:
+                        self.put(key, cached, age)
+                        self.shared_hits += 1
+                        return cached
+        self.misses += 1
+
+        flight_key = flight_key if flight_key is not None else key
+        future = self._inflight.get(flight_key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(key, flight_key, probe))
+            self._inflight[flight_key] = future
+        else:
+            self.coalesced += 1
+        # One caller going away must not cancel the probe the others wait on
+        return await asyncio.shield(future)
+
+    async def _run(self, key: str, flight_key: Hashable, probe: Callable[[], Awaitable[Dict[str, Any]]]):
+        try:
+            value = await probe()
+            self.put(key, value)
+            return value
+        finally:
+            self._inflight.pop(flight_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+_probe_cache: Optional[ProbeCache] = None
+
+
+def get_probe_cache() -> ProbeCache:
+    """Return the process-wide probe cache"""
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = ProbeCache(shared=SharedProbeResults() if PROBE_CACHE_SHARED == "redis" else None)
+    return _probe_cache
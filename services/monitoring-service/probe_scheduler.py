@@ -0,0 +1,170 @@
+import os
+import random
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "30"))
+PROBE_INTERVAL_MIN = float(os.getenv("PROBE_INTERVAL_MIN", "10"))
+PROBE_INTERVAL_MAX = float(os.getenv("PROBE_INTERVAL_MAX", "300"))
+PROBE_FLAP_WINDOW = float(os.getenv("PROBE_FLAP_WINDOW", "900"))  # seconds since last status change
+PROBE_STABLE_AFTER = float(os.getenv("PROBE_STABLE_AFTER", "3600"))  # back off after this long unchanged
+CRITICAL_DEVICE_TYPES = {
+    device_type.strip()
+    for device_type in os.getenv("CRITICAL_DEVICE_TYPES", "router,switch,firewall").split(",")
+    if device_type.strip()
+}
+WHEEL_TICK = float(os.getenv("WHEEL_TICK", "1.0"))
+WHEEL_SLOTS = int(os.getenv("WHEEL_SLOTS", "512"))
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel. Scheduling and cancelling are O(1); each tick only
+    touches the keys hashed into the current slot. Delays longer than one
+    revolution are tracked with a per-key round counter.
+    """
+
+    def __init__(self, tick: float = WHEEL_TICK, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self.slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self.cursor = 0
+        self._slot_of: Dict[Hashable, int] = {}
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, key: Hashable, delay: float):
+        """(Re)schedule ``key`` to come due ``delay`` seconds from the current tick"""
+        self.cancel(key)
+        ticks = max(1, round(delay / self.tick))
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot][key] = (ticks - 1) // len(self.slots)
+        self._slot_of[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def advance(self) -> List[Hashable]:
+        """Move to the next tick and return the keys that came due"""
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        bucket = self.slots[self.cursor]
+        due = []
+        for key, rounds in list(bucket.items()):
+            if rounds:
+                bucket[key] = rounds - 1
+            else:
+                due.append(key)
+                del bucket[key]
+                del self._slot_of[key]
+        return due
+
+
+class DeviceSchedule:
+    """Per-device probe state kept between ticks"""
+
+    __slots__ = (
+        "id", "organization_id", "ip_address", "device_type", "location",
+        "status", "last_seen", "interval", "last_change",
+    )
+
+    def __init__(self, device: Any, now: float):
+        self.id = device.id
+        self.status = device.status
+        self.last_seen = device.last_seen
+        # Nothing is known about a device's history yet: neither flapping nor stable
+        self.last_change = now - PROBE_FLAP_WINDOW
+        self.interval = PROBE_INTERVAL
+        self.update(device)
+
+    def update(self, device: Any):
+        self.organization_id = device.organization_id
+        self.ip_address = device.ip_address
+        self.device_type = device.device_type
+        self.location = device.location
+
+
+class AdaptiveProbeScheduler:
+    """
+    Decides when each device is probed next.
+
+    Devices start at a random offset within their interval so the fleet is
+    spread evenly across the wheel. Critical device types and devices that
+    changed status recently are probed every PROBE_INTERVAL_MIN seconds;
+    devices unchanged for PROBE_STABLE_AFTER seconds back off exponentially
+    up to PROBE_INTERVAL_MAX.
+    """
+
+    def __init__(self, wheel: Optional[TimingWheel] = None):
+        self.wheel = wheel or TimingWheel()
+        self.devices: Dict[Any, DeviceSchedule] = {}
+
+    def interval_for(self, state: DeviceSchedule, now: float) -> float:
+        unchanged_for = now - state.last_change
+        if state.device_type in CRITICAL_DEVICE_TYPES or unchanged_for < PROBE_FLAP_WINDOW:
+            return PROBE_INTERVAL_MIN
+        if unchanged_for >= PROBE_STABLE_AFTER:
+            return min(PROBE_INTERVAL_MAX, PROBE_INTERVAL * 2 ** int(unchanged_for // PROBE_STABLE_AFTER))
+        return PROBE_INTERVAL
+
+    def sync(self, devices: List[Any]):
+        """Reconcile with the current fleet: schedule new devices, drop deleted ones"""
+        now = time.monotonic()
+        current = set()
+        for device in devices:
+            current.add(device.id)
+            state = self.devices.get(device.id)
+            if state is None:
+                state = self.devices[device.id] = DeviceSchedule(device, now)
+                state.interval = self.interval_for(state, now)
+                self.wheel.schedule(device.id, random.uniform(0, state.interval))
+            else:
+                state.update(device)
+
+        for device_id in list(self.devices):
+            if device_id not in current:
+                del self.devices[device_id]
+                self.wheel.cancel(device_id)
+
+    def due(self) -> List[DeviceSchedule]:
+        """Advance the wheel one tick and return the devices to probe now"""
+        return [self.devices[key] for key in self.wheel.advance() if key in self.devices]
+
+    def record(self, state: DeviceSchedule, new_status: str):
+        """Record a probe outcome and schedule the device's next probe"""
+        now = time.monotonic()
+        if state.status != new_status:
+            state.status = new_status
+            state.last_change = now
+        state.interval = self.interval_for(state, now)
+        if state.id in self.devices:
+            # +/-10% jitter keeps devices from drifting back into lockstep
+            self.wheel.schedule(state.id, state.interval * random.uniform(0.9, 1.1))
+
+    def probe_rate(self) -> float:
+        """Steady-state probes per second across the fleet"""
+        return sum(1.0 / state.interval for state in self.devices.values())
+
+    def stats(self) -> Dict[str, Any]:
+        intervals: Dict[str, int] = {}
+        for state in self.devices.values():
+            key = f"{state.interval:g}s"
+            intervals[key] = intervals.get(key, 0) + 1
+        return {
+            "devices": len(self.devices),
+            "probes_per_second": round(self.probe_rate(), 2),
+            "tick_seconds": self.wheel.tick,
+            "intervals": intervals,
+        }
+
+
+_probe_scheduler: Optional[AdaptiveProbeScheduler] = None
+
+
+def get_probe_scheduler() -> AdaptiveProbeScheduler:
+    """Return the process-wide probe scheduler"""
+    global _probe_scheduler
+    if _probe_scheduler is None:
+        _probe_scheduler = AdaptiveProbeScheduler()
+    return _probe_scheduler
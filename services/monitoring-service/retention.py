@@ -0,0 +1,165 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from rollups import ROLLUPS_BY_NAME, has_timescaledb
+
+METRICS_RETENTION_RAW_DAYS = int(os.getenv("METRICS_RETENTION_RAW_DAYS", "30"))
+METRICS_RETENTION_1M_DAYS = int(os.getenv("METRICS_RETENTION_1M_DAYS", "90"))
+METRICS_RETENTION_5M_DAYS = int(os.getenv("METRICS_RETENTION_5M_DAYS", "365"))
+METRICS_RETENTION_1H_DAYS = int(os.getenv("METRICS_RETENTION_1H_DAYS", "1825"))
+METRICS_COMPRESS_AFTER_DAYS = int(os.getenv("METRICS_COMPRESS_AFTER_DAYS", "7"))  # 0 disables compression
+METRICS_RETENTION_DELETE_BATCH = int(os.getenv("METRICS_RETENTION_DELETE_BATCH", "50000"))  # rows per DELETE without TimescaleDB
+
+
+class RetentionRule(NamedTuple):
+    relation: str
+    time_column: str
+    keep_days: int  # 0 keeps everything
+
+
+RETENTION_RULES: List[RetentionRule] = [
+    RetentionRule("device_metrics", "time", METRICS_RETENTION_RAW_DAYS),
+    RetentionRule(ROLLUPS_BY_NAME["1m"].table.name, "bucket", METRICS_RETENTION_1M_DAYS),
+    RetentionRule(ROLLUPS_BY_NAME["5m"].table.name, "bucket", METRICS_RETENTION_5M_DAYS),
+    RetentionRule(ROLLUPS_BY_NAME["1h"].table.name, "bucket", METRICS_RETENTION_1H_DAYS),
+]
+
+
+def _hypertable(conn, relation: str) -> Optional[str]:
+    """The hypertable holding a relation's rows: itself, or a continuous aggregate's materialization"""
+    row = conn.execute(
+        text(
+            "SELECT format('%I.%I', materialization_hypertable_schema, materialization_hypertable_name) "
+            "FROM timescaledb_information.continuous_aggregates WHERE view_name = :relation"
+        ),
+        {"relation": relation},
+    ).scalar()
+    if row:
+        return row
+    is_hypertable = conn.execute(
+        text("SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = :relation"),
+        {"relation": relation},
+    ).scalar()
+    return relation if is_hypertable else None
+
+
+def relation_bytes(conn, relation: str, timescale: bool) -> int:
+    """On-disk size of a table, hypertable or continuous aggregate including indexes and TOAST"""
+    hypertable = _hypertable(conn, relation) if timescale else None
+    if hypertable:
+        return conn.execute(text("SELECT hypertable_size(CAST(:relation AS regclass))"), {"relation": hypertable}).scalar() or 0
+    return conn.execute(text("SELECT pg_total_relation_size(CAST(:relation AS regclass))"), {"relation": relation}).scalar() or 0
+
+
+def _ensure_compression(conn):
+    enabled = conn.execute(text(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables WHERE hypertable_name = 'device_metrics'"
+    )).scalar()
+    if not enabled:
+        conn.execute(text(
+            "ALTER TABLE device_metrics SET (timescaledb.compress, "
+            "timescaledb.compress_segmentby = 'device_id, metric_type_id', "
+            "timescaledb.compress_orderby = 'time DESC')"
+        ))
+
+
+def _apply_timescale(conn, rule: RetentionRule, cutoff: datetime, report: Dict[str, Any]):
+    hypertable = _hypertable(conn, rule.relation)
+    if hypertable is None:
+        return
+    if rule.keep_days:
+        report["chunks_dropped"] = len(conn.execute(
+            text("SELECT drop_chunks(CAST(:relation AS regclass), older_than => :cutoff)"),
+            {"relation": hypertable, "cutoff": cutoff},
+        ).all())
+    if rule.relation == "device_metrics" and METRICS_COMPRESS_AFTER_DAYS:
+        _ensure_compression(conn)
+        compress_before = datetime.now(timezone.utc) - timedelta(days=METRICS_COMPRESS_AFTER_DAYS)
+        report["chunks_compressed"] = len(conn.execute(
+            text(
+                "SELECT compress_chunk(format('%I.%I', chunk_schema, chunk_name)::regclass) "
+                "FROM timescaledb_information.chunks "
+                "WHERE hypertable_name = 'device_metrics' AND NOT is_compressed AND range_end < :before"
+            ),
+            {"before": compress_before},
+        ).all())
+
+
+def _apply_plain(conn, rule: RetentionRule, cutoff: datetime, report: Dict[str, Any]):
+    """Delete expired rows in bounded batches so no statement holds locks for long"""
+    if not rule.keep_days:
+        return
+    estimated_rows = conn.execute(
+        text("SELECT reltuples FROM pg_class WHERE oid = CAST(:relation AS regclass)"), {"relation": rule.relation}
+    ).scalar()
+    deleted = 0
+    while True:
+        result = conn.execute(
+            text(
+                f"DELETE FROM {rule.relation} WHERE ctid IN ("
+                f"SELECT ctid FROM {rule.relation} WHERE {rule.time_column} < :cutoff LIMIT :batch)"
+            ),
+            {"cutoff": cutoff, "batch": METRICS_RETENTION_DELETE_BATCH},
+        )
+        conn.commit()
+        deleted += result.rowcount
+        if result.rowcount < METRICS_RETENTION_DELETE_BATCH:
+            break
+    report["rows_deleted"] = deleted
+    # Vacuumed space stays in the table for new rows rather than shrinking the file
+    if estimated_rows and estimated_rows > 0:
+        report["bytes_reusable"] = int(report["bytes_before"] * min(deleted / estimated_rows, 1.0))
+
+
+def apply_retention(engine) -> Dict[str, Any]:
+    """
+    Drop expired metrics and compress old raw chunks.
+
+    With TimescaleDB, chunks older than each relation's retention are
+    dropped whole and raw chunks older than METRICS_COMPRESS_AFTER_DAYS
+    are compressed, which returns space to the filesystem immediately.
+    Without it, expired rows are deleted in batches and the tables are
+    vacuumed so the space is reused by new rows; that space is reported as
+    ``bytes_reusable`` since the files rarely shrink. Returns per-relation
+    details, total bytes reclaimed and the run's duration.
+    """
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    relations = {}
+    with engine.connect() as conn:
+        timescale = has_timescaledb(conn)
+        for rule in RETENTION_RULES:
+            if not conn.execute(text("SELECT to_regclass(:relation)"), {"relation": rule.relation}).scalar():
+                continue
+            report = {"keep_days": rule.keep_days, "bytes_before": relation_bytes(conn, rule.relation, timescale)}
+            cutoff = now - timedelta(days=rule.keep_days)
+            if timescale:
+                _apply_timescale(conn, rule, cutoff, report)
+                conn.commit()
+            else:
+                _apply_plain(conn, rule, cutoff, report)
+            relations[rule.relation] = report
+
+    if not timescale:
+        # VACUUM cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for relation, report in relations.items():
+                if report.get("rows_deleted"):
+                    conn.execute(text(f"VACUUM (ANALYZE) {relation}"))
+
+    with engine.connect() as conn:
+        for relation, report in relations.items():
+            report["bytes_after"] = relation_bytes(conn, relation, timescale)
+            # VACUUM can add a free space map page or two; never report that as negative
+            report["bytes_reclaimed"] = max(report["bytes_before"] - report["bytes_after"], 0)
+
+    return {
+        "relations": relations,
+        "bytes_reclaimed": sum(report["bytes_reclaimed"] for report in relations.values()),
+        "bytes_reusable": sum(report.get("bytes_reusable", 0) for report in relations.values()),
+        "duration_seconds": round(time.perf_counter() - started, 3),
+    }
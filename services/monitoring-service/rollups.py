@@ -0,0 +1,148 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Float, MetaData, PrimaryKeyConstraint, SmallInteger, Table, text,
+)
+from sqlalchemy.dialects.postgresql import UUID
+
+ROLLUP_REFRESH_INTERVAL = int(os.getenv("ROLLUP_REFRESH_INTERVAL", "60"))  # seconds
+ROLLUP_REFRESH_LOOKBACK = int(os.getenv("ROLLUP_REFRESH_LOOKBACK", "7200"))  # seconds re-aggregated per refresh
+
+# Rollups are views under TimescaleDB, so they live outside Base.metadata
+# and create_all never turns them into plain tables by accident
+rollup_metadata = MetaData()
+
+
+def _rollup_table(name: str) -> Table:
+    return Table(
+        name,
+        rollup_metadata,
+        Column("bucket", DateTime(timezone=True), nullable=False),
+        Column("device_id", UUID(as_uuid=True), nullable=False),
+        Column("metric_type_id", SmallInteger, nullable=False),
+        Column("value_min", Float),
+        Column("value_max", Float),
+        Column("value_sum", Float),
+        Column("value_count", BigInteger),
+        PrimaryKeyConstraint("device_id", "metric_type_id", "bucket"),
+    )
+
+
+class Rollup(NamedTuple):
+    name: str  # resolution as accepted by GET /metrics/{device_id}
+    seconds: int
+    table: Table
+    source: Optional[str]  # finer rollup it is built from; None for raw device_metrics
+
+
+# Finest first; each level is aggregated from the one before it
+ROLLUPS: List[Rollup] = [
+    Rollup("1m", 60, _rollup_table("device_metrics_1m"), None),
+    Rollup("5m", 300, _rollup_table("device_metrics_5m"), "1m"),
+    Rollup("1h", 3600, _rollup_table("device_metrics_1h"), "5m"),
+]
+ROLLUPS_BY_NAME = {rollup.name: rollup for rollup in ROLLUPS}
+
+
+def has_timescaledb(conn) -> bool:
+    return bool(conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")).scalar())
+
+
+def _source(rollup: Rollup):
+    """(relation, time column, min, max, sum, count expressions) a rollup aggregates"""
+    if rollup.source is None:
+        return "device_metrics", "time", "min(value)", "max(value)", "sum(value)", "count(*)"
+    finer = ROLLUPS_BY_NAME[rollup.source]
+    return (finer.table.name, "bucket",
+            "min(value_min)", "max(value_max)", "sum(value_sum)", "sum(value_count)::bigint")
+
+
+def ensure_rollups(engine):
+    """
+    Create the rollups if missing. With TimescaleDB they are hierarchical
+    continuous aggregates refreshed by TimescaleDB policies, with real-time
+    aggregation so the newest bucket is always included. Without it they are
+    plain tables kept current by refresh_rollups().
+    """
+    with engine.begin() as conn:
+        if not has_timescaledb(conn):
+            rollup_metadata.create_all(bind=conn)
+            return
+
+        conn.execute(text(
+            "SELECT create_hypertable('device_metrics', 'time', if_not_exists => TRUE, migrate_data => TRUE)"
+        ))
+        for rollup in ROLLUPS:
+            relation, time_column, value_min, value_max, value_sum, value_count = _source(rollup)
+            bucket = f"time_bucket(INTERVAL '{rollup.seconds} seconds', {time_column})"
+            conn.execute(text(f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS {rollup.table.name}
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                SELECT {bucket} AS bucket, device_id, metric_type_id,
+                       {value_min} AS value_min, {value_max} AS value_max,
+                       {value_sum} AS value_sum, {value_count} AS value_count
+                FROM {relation}
+                GROUP BY {bucket}, device_id, metric_type_id
+                WITH NO DATA
+            """))
+            conn.execute(
+                text("""
+                    SELECT add_continuous_aggregate_policy(
+                        CAST(:view AS regclass),
+                        start_offset => CAST(:start AS interval),
+                        end_offset => CAST(:end AS interval),
+                        schedule_interval => CAST(:schedule AS interval),
+                        if_not_exists => TRUE
+                    )
+                """),
+                {
+                    "view": rollup.table.name,
+                    "start": f"{max(ROLLUP_REFRESH_LOOKBACK, 4 * rollup.seconds)} seconds",
+                    "end": f"{rollup.seconds} seconds",
+                    "schedule": f"{max(ROLLUP_REFRESH_INTERVAL, rollup.seconds)} seconds",
+                },
+            )
+
+
+def refresh_rollups(conn, now: Optional[datetime] = None) -> bool:
+    """
+    Re-aggregate the last ROLLUP_REFRESH_LOOKBACK seconds into the plain
+    rollup tables, finest first. Returns False when TimescaleDB maintains
+    the rollups itself and there is nothing to do.
+    """
+    if has_timescaledb(conn):
+        return False
+
+    now = now or datetime.now(timezone.utc)
+    for rollup in ROLLUPS:
+        relation, time_column, value_min, value_max, value_sum, value_count = _source(rollup)
+        bucket = f"to_timestamp(floor(extract(epoch FROM {time_column}) / {rollup.seconds}) * {rollup.seconds})"
+        start = now - timedelta(seconds=max(ROLLUP_REFRESH_LOOKBACK, rollup.seconds))
+        start = datetime.fromtimestamp(start.timestamp() // rollup.seconds * rollup.seconds, timezone.utc)
+        conn.execute(
+            text(f"""
+                INSERT INTO {rollup.table.name}
+                    (bucket, device_id, metric_type_id, value_min, value_max, value_sum, value_count)
+                SELECT {bucket}, device_id, metric_type_id, {value_min}, {value_max}, {value_sum}, {value_count}
+                FROM {relation}
+                WHERE {time_column} >= :start
+                GROUP BY 1, device_id, metric_type_id
+                ON CONFLICT (device_id, metric_type_id, bucket) DO UPDATE SET
+                    value_min = EXCLUDED.value_min,
+                    value_max = EXCLUDED.value_max,
+                    value_sum = EXCLUDED.value_sum,
+                    value_count = EXCLUDED.value_count
+            """),
+            {"start": start},
+        )
+    return True
+
+
+def select_rollup(span_seconds: float, max_points: int) -> Rollup:
+    """Finest rollup with at most ``max_points`` buckets per series over the span, else the coarsest"""
+    for rollup in ROLLUPS:
+        if span_seconds / rollup.seconds <= max_points:
+            return rollup
+    return ROLLUPS[-1]
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 import uuid
 
@@ -18,6 +18,43 @@ class DeviceMetricCreate(DeviceMetricBase):
 class DeviceMetricResponse(DeviceMetricBase):
     device_id: uuid.UUID
     time: datetime
+    # Set for rolled-up rows only, where value is the bucket average
+    min: Optional[float] = None
+    max: Optional[float] = None
+    count: Optional[int] = None
 
     class Config:
         from_attributes = True
+
+
+class MetricRejection(BaseModel):
+    index: int
+    error: str
+
+
+class MetricBatchResponse(BaseModel):
+    accepted: int
+    rejected: List[MetricRejection] = []
+
+
+class MetricStreamResponse(BaseModel):
+    accepted: int
+    rejected_count: int
+    rejected: List[MetricRejection] = []  # the first METRICS_STREAM_MAX_REJECTIONS only
+
+
+class MetricQuery(BaseModel):
+    device_ids: List[uuid.UUID]
+    metric_types: Optional[List[str]] = None  # all types when omitted
+    start: Optional[datetime] = None  # defaults to `hours` before end
+    end: Optional[datetime] = None  # defaults to now
+    hours: int = 24
+    max_points: Optional[int] = Field(None, ge=1)
+    resolution: Optional[Literal["raw", "1m", "5m", "1h"]] = None
+    points: Optional[int] = Field(None, ge=3)
+    format: Literal["rows", "columnar"] = "rows"
+
+
+class MetricQueryResponse(BaseModel):
+    resolution: str
+    devices: Dict[uuid.UUID, List[DeviceMetricResponse]]
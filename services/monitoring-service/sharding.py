@@ -0,0 +1,100 @@
+import bisect
+import hashlib
+import os
+from functools import lru_cache
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+MONITORING_SHARDS = int(os.getenv("MONITORING_SHARDS", "0"))  # 0 = size from live workers
+MONITORING_SHARDS_PER_WORKER = int(os.getenv("MONITORING_SHARDS_PER_WORKER", "4"))
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "160"))
+
+# _hash() of devices.id computed by PostgreSQL, as a signed bigint
+RING_HASH_SQL = "(('x' || substr(md5(CAST(id AS text)), 1, 16))::bit(64)::bigint)"
+_SIGN = 1 << 63
+
+
+def _hash(key: str) -> int:
+    # Python's hash() is salted per process; shards must agree across workers
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping device ids onto ``shard_count`` shards.
+    Growing or shrinking the ring only moves the devices that hash next to
+    the added or removed shard's virtual nodes.
+    """
+
+    def __init__(self, shard_count: int, virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        self.shard_count = shard_count
+        points: List[Tuple[int, int]] = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shard_count)
+            for replica in range(virtual_nodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, device_id: str) -> int:
+        index = bisect.bisect(self._keys, _hash(device_id)) % len(self._keys)
+        return self._shards[index]
+
+    def ranges(self, shard: int) -> List[Tuple[int, int]]:
+        """Half-open [start, end) ranges of hashes that shard_for() maps to ``shard``"""
+        ranges: List[Tuple[int, int]] = []
+        starts = [0] + self._keys
+        ends = self._keys + [1 << 64]
+        for index, (start, end) in enumerate(zip(starts, ends)):
+            if self._shards[index % len(self._keys)] != shard or start == end:
+                continue
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def shard_clause(self, shard: int):
+        """
+        WHERE clause selecting the devices of ``shard`` in SQL, so a shard
+        reads only its own rows; served by ix_devices_ring_hash
+        """
+        conditions = []
+        for start, end in self.ranges(shard):
+            # Hashes are unsigned; PostgreSQL compares them as signed bigints
+            pieces = [(start, end)] if end <= _SIGN or start >= _SIGN else [(start, _SIGN), (_SIGN, end)]
+            for low, high in pieces:
+                low, high = (low, high) if low < _SIGN else (low - (1 << 64), high - (1 << 64))
+                conditions.append(f"({RING_HASH_SQL} >= {low} AND {RING_HASH_SQL} <= {high - 1})")
+        return text(" OR ".join(conditions) or "false")
+
+
+@lru_cache(maxsize=8)
+def get_ring(shard_count: int) -> HashRing:
+    return HashRing(shard_count)
+
+
+def ensure_ring_index(engine):
+    """Index devices by ring hash so shard queries need not hash every row"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_devices_ring_hash ON devices ({RING_HASH_SQL})"))
+    except Exception as e:
+        print(f"Ring hash index error: {e}")
+
+
+def get_shard_count(celery_app) -> int:
+    """
+    Number of shards to fan a sweep out to. Fixed by MONITORING_SHARDS, or
+    sized from the workers currently answering a broadcast ping so capacity
+    follows the worker pool as it grows and shrinks.
+    """
+    if MONITORING_SHARDS > 0:
+        return MONITORING_SHARDS
+    try:
+        replies = celery_app.control.ping(timeout=0.5) or []
+    except Exception as e:
+        print(f"Worker discovery failed: {e}")
+        replies = []
+    return max(1, len(replies)) * MONITORING_SHARDS_PER_WORKER
@@ -0,0 +1,117 @@
+import asyncio
+import ipaddress
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+SWEEP_MAX_IN_FLIGHT = int(os.getenv("SWEEP_MAX_IN_FLIGHT", "1000"))
+SWEEP_SUBNET_RATE = float(os.getenv("SWEEP_SUBNET_RATE", "100"))  # probes per second per /24
+SWEEP_SUBNET_BURST = int(os.getenv("SWEEP_SUBNET_BURST", "20"))
+SWEEP_DEADLINE = float(os.getenv("SWEEP_DEADLINE", "25"))
+
+
+def subnet_key(ip_address: str) -> str:
+    """Group addresses by /24 (IPv4) or /64 (IPv6); hostnames pace on their own"""
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return ip_address
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+class TokenBucket:
+    """Token bucket that paces callers to ``rate`` acquisitions per second"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SweepResult:
+    """Outcome of a sweep: results by item index plus the items that missed the deadline"""
+
+    def __init__(self, results: Dict[int, Any], timed_out: List[int], duration: float):
+        self.results = results
+        self.timed_out = timed_out
+        self.duration = duration
+
+
+class SweepScheduler:
+    """
+    Runs one probe per item with a global in-flight cap, per-group token
+    bucket pacing and an overall deadline. Probes still running when the
+    deadline passes are cancelled and reported in ``timed_out``.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = SWEEP_MAX_IN_FLIGHT,
+        group_rate: float = SWEEP_SUBNET_RATE,
+        group_burst: int = SWEEP_SUBNET_BURST,
+        deadline: float = SWEEP_DEADLINE,
+    ):
+        self.max_in_flight = max_in_flight
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.deadline = deadline
+        # Shared by every run() on this scheduler so overlapping batches
+        # respect one in-flight cap and one pacing budget per group
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    async def run(
+        self,
+        items: Sequence[Any],
+        probe: Callable[[Any], Awaitable[Any]],
+        group_key: Callable[[Any], str],
+        deadline: Optional[float] = None,
+    ) -> SweepResult:
+        started_at = time.monotonic()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        semaphore = self._semaphore
+        buckets = self._buckets
+
+        async def run_one(item):
+            key = group_key(item)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = TokenBucket(self.group_rate, self.group_burst)
+            # Wait for the group's pacing before taking a global slot so a busy
+            # subnet does not hold slots that other subnets could use.
+            await bucket.acquire()
+            async with semaphore:
+                return await probe(item)
+
+        tasks = {asyncio.ensure_future(run_one(item)): index for index, item in enumerate(items)}
+        if not tasks:
+            return SweepResult({}, [], 0.0)
+
+        done, pending = await asyncio.wait(tasks, timeout=deadline or self.deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        results = {}
+        for task in done:
+            if not task.cancelled() and task.exception() is None:
+                results[tasks[task]] = task.result()
+
+        timed_out = sorted(tasks[task] for task in pending)
+        return SweepResult(results, timed_out, time.monotonic() - started_at)
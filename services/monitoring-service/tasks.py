@@ -1,26 +1,73 @@
-from celery_app import celery_app
-from database import SessionLocal
+from celery_app import celery_app, MONITORING_INTERVAL
+from database import SessionLocal, engine
 from monitoring_service import MonitoringService
-import httpx
+from sharding import get_shard_count
+from rollups import refresh_rollups
+from retention import apply_retention
 import asyncio
-import os
 
-DEVICE_SERVICE_URL = os.getenv("DEVICE_SERVICE_URL", "http://device-service:8002")
 
 @celery_app.task(name="monitor_devices_task")
 def monitor_devices_task():
-    """Celery task to monitor all devices"""
-    db = SessionLocal()
+    """Celery task to fan a monitoring sweep out to one task per shard"""
     try:
-        monitoring_service = MonitoringService(db)
-        
-        # This would typically get devices from device service
-        # For now, we'll implement a simple version
-        print("Monitoring devices task executed")
-        
-        return {"status": "completed", "devices_checked": 0}
+        shard_count = get_shard_count(celery_app)
+        for shard in range(shard_count):
+            celery_app.send_task(
+                "monitor_shard_task",
+                args=[shard, shard_count],
+                queue="monitoring",
+                # A shard that waited out a whole interval is superseded by the next sweep
+                expires=MONITORING_INTERVAL,
+            )
+        return {"status": "dispatched", "shards": shard_count}
     except Exception as e:
         print(f"Error in monitoring task: {e}")
         return {"status": "error", "error": str(e)}
+
+
+@celery_app.task(name="monitor_shard_task")
+def monitor_shard_task(shard: int, shard_count: int):
+    """Celery task to monitor the devices of one shard"""
+    db = SessionLocal()
+    try:
+        monitoring_service = MonitoringService(db)
+        sweep = asyncio.run(monitoring_service.monitor_all_devices(shard=shard, shard_count=shard_count))
+        return {
+            "status": "completed",
+            "shard": shard,
+            "status_changes": len(sweep["status_changes"]),
+            "unprobed": len(sweep["unprobed"]),
+        }
+    except Exception as e:
+        print(f"Error in monitoring shard {shard}/{shard_count}: {e}")
+        return {"status": "error", "shard": shard, "error": str(e)}
     finally:
         db.close()
+
+
+@celery_app.task(name="refresh_rollups_task")
+def refresh_rollups_task():
+    """Celery task to bring the 1m/5m/1h metric rollups up to date when TimescaleDB does not"""
+    try:
+        with engine.begin() as conn:
+            refreshed = refresh_rollups(conn)
+        return {"status": "completed" if refreshed else "skipped"}
+    except Exception as e:
+        print(f"Error refreshing metric rollups: {e}")
+        return {"status": "error", "error": str(e)}
+
+
+@celery_app.task(name="apply_retention_task")
+def apply_retention_task():
+    """Celery task to drop expired metrics and compress old chunks"""
+    try:
+        result = apply_retention(engine)
+        print(
+            f"Metric retention reclaimed {result['bytes_reclaimed']} bytes "
+            f"({result['bytes_reusable']} reusable) in {result['duration_seconds']}s"
+        )
+        return {"status": "completed", **result}
+    except Exception as e:
+        print(f"Error applying metric retention: {e}")
+        return {"status": "error", "error": str(e)}
@@ -0,0 +1,335 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from ws_manager import event_topics
+
+WS_BACKPLANE = os.getenv("WS_BACKPLANE", "redis")  # redis, or memory for a single process and tests
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+WS_BACKPLANE_CHANNEL = os.getenv("WS_BACKPLANE_CHANNEL", "netpulse:ws-events")
+WS_BACKPLANE_FLUSH_INTERVAL = float(os.getenv("WS_BACKPLANE_FLUSH_INTERVAL", "0.05"))  # seconds events wait to be batched
+WS_BACKPLANE_BATCH_MAX = int(os.getenv("WS_BACKPLANE_BATCH_MAX", "500"))  # events per published message
+WS_BACKPLANE_DEDUP_SIZE = int(os.getenv("WS_BACKPLANE_DEDUP_SIZE", "10000"))  # recent event keys remembered
+
+# (topics, JSON-serializable message, key); equal keys are the same event
+Event = Tuple[List[str], Dict[str, Any], str]
+# (seq, topics, message); seq is None for events that could not go through the backplane
+Deliver = Callable[[Optional[int], List[str], Dict[str, Any]], None]
+# Called with the sequence number after which every event will be delivered
+Reset = Callable[[int], None]
+
+# Numbers a batch and publishes it in one step, so sequence order is channel order
+_PUBLISH_SCRIPT = """
+local last = redis.call('INCRBY', KEYS[1], ARGV[1])
+redis.call('PUBLISH', KEYS[2], (last - tonumber(ARGV[1]) + 1) .. ' ' .. ARGV[2])
+return last
+"""
+
+
+def make_event(topics: Iterable[str], message: Dict[str, Any], key: Optional[str] = None) -> Event:
+    """An event whose key defaults to a digest of its topics and message"""
+    topics = list(topics)
+    if key is None:
+        digest = "\n".join(topics + [json.dumps(message, sort_keys=True)])
+        key = hashlib.blake2b(digest.encode(), digest_size=12).hexdigest()
+    return topics, message, key
+
+
+def status_change_event(
+    organization_id: Any, device_id: Any, device_type: Optional[str], status: str, timestamp: datetime
+) -> Event:
+    """A device_status_change event on every topic the device belongs to"""
+    message = {
+        "type": "device_status_change",
+        "data": {"device_id": str(device_id), "status": status, "timestamp": timestamp.isoformat()},
+    }
+    return make_event(event_topics(organization_id, device_id, device_type), message)
+
+
+class Backplane(abc.ABC):
+    """
+    Carries WebSocket events between monitoring service processes.
+
+    Any process can publish(); every process that has called start() hands
+    each event to its ``deliver`` callback (StatusCoalescer.deliver), its
+    own events included, so sockets on every replica see the same stream.
+    Each published batch is numbered from one sequence shared by all
+    replicas, so an event has the same ``seq`` everywhere and later events
+    have higher ones.
+    Events published on the event loop are batched for
+    WS_BACKPLANE_FLUSH_INTERVAL seconds or WS_BACKPLANE_BATCH_MAX events;
+    processes that never started it (Celery workers) publish synchronously,
+    in messages of at most WS_BACKPLANE_BATCH_MAX events.
+    Duplicate keys within a batch are dropped before sending, and keys seen
+    recently are dropped on delivery, so an event published twice reaches
+    each socket once.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._deliver: Optional[Deliver] = None
+        self._reset: Optional[Reset] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: "OrderedDict[str, Event]" = OrderedDict()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self.published = 0
+        self.batches = 0
+        self.delivered = 0
+        self.duplicates = 0
+
+    async def start(self, deliver: Deliver, reset: Optional[Reset] = None):
+        self._deliver = deliver
+        self._reset = reset
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            await self._send(self._take_batch())
+        self._deliver = None
+
+    def publish(self, topics: Iterable[str], message: Dict[str, Any], key: Optional[str] = None):
+        self.publish_events([make_event(topics, message, key)])
+
+    def publish_events(self, events: List[Event]):
+        """Publish from any thread: batched on a started event loop, otherwise sent right away"""
+        if not events:
+            return
+        loop = self._loop
+        if loop is None or self._deliver is None:
+            for first in range(0, len(events), WS_BACKPLANE_BATCH_MAX):
+                try:
+                    self._send_sync(events[first:first + WS_BACKPLANE_BATCH_MAX])
+                except Exception as e:
+                    print(f"WebSocket backplane publish error: {e}")
+                    return  # the remaining batches would wait out the same failure
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._queue(events)
+        else:
+            loop.call_soon_threadsafe(self._queue, events)
+
+    def _queue(self, events: List[Event]):
+        for event in events:
+            if event[2] in self._pending:
+                self.duplicates += 1
+            else:
+                self._pending[event[2]] = event
+        if len(self._pending) >= WS_BACKPLANE_BATCH_MAX:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(WS_BACKPLANE_FLUSH_INTERVAL)
+
+    def _schedule_flush(self, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = self._loop.call_later(delay, lambda: asyncio.ensure_future(self._flush()))
+
+    def _take_batch(self) -> List[Event]:
+        batch = []
+        while self._pending and len(batch) < WS_BACKPLANE_BATCH_MAX:
+            batch.append(self._pending.popitem(last=False)[1])
+        return batch
+
+    async def _flush(self):
+        self._flush_handle = None
+        batch = self._take_batch()
+        if self._pending:
+            self._schedule_flush(0)
+        if batch:
+            try:
+                await self._send(batch)
+            except Exception as e:
+                print(f"WebSocket backplane publish error: {e}")
+                # Other replicas miss these, but this one's sockets still get them
+                for topics, message, key in batch:
+                    self._accept(None, key, topics, message)
+
+    def _encode(self, events: List[Event]) -> str:
+        self.published += len(events)
+        self.batches += 1
+        return json.dumps({
+            "origin": self.origin,
+            "events": [{"topics": topics, "message": message, "key": key} for topics, message, key in events],
+        })
+
+    def _receive(self, first_seq: int, payload: Any):
+        """Hand a published batch to the local deliver callback, skipping recently seen keys"""
+        if self._deliver is None:
+            return
+        try:
+            events = json.loads(payload)["events"]
+        except (ValueError, KeyError, TypeError):
+            return
+        for offset, event in enumerate(events):
+            self._accept(first_seq + offset, event.get("key"), event["topics"], event["message"])
+
+    def _accept(self, seq: Optional[int], key: str, topics: List[str], message: Dict[str, Any]):
+        if key in self._seen:
+            self.duplicates += 1
+            return
+        self._seen[key] = None
+        if len(self._seen) > WS_BACKPLANE_DEDUP_SIZE:
+            self._seen.popitem(last=False)
+        self.delivered += 1
+        self._deliver(seq, topics, message)
+
+    def _subscribed(self, seq: int):
+        if self._reset is not None:
+            self._reset(seq)
+
+    @abc.abstractmethod
+    async def _send(self, events: List[Event]):
+        """Publish a batch from the event loop"""
+
+    @abc.abstractmethod
+    def _send_sync(self, events: List[Event]):
+        """Publish a batch from a process that never started the backplane"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backplane": type(self).__name__,
+            "pending": len(self._pending),
+            "published": self.published,
+            "batches": self.batches,
+            "delivered": self.delivered,
+            "duplicates": self.duplicates,
+        }
+
+
+class MemoryHub:
+    """Stands in for the Redis channel between backplanes in one process"""
+
+    def __init__(self):
+        self.backplanes: List["MemoryBackplane"] = []
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    def send(self, count: int, payload: str):
+        with self._lock:
+            first_seq = self.seq + 1
+            self.seq += count
+            backplanes = list(self.backplanes)
+        for backplane in backplanes:
+            if backplane._loop is not None:
+                backplane._loop.call_soon_threadsafe(backplane._receive, first_seq, payload)
+
+
+class MemoryBackplane(Backplane):
+    """Backplane for a single process and for tests; instances sharing a hub act as replicas"""
+
+    def __init__(self, hub: Optional[MemoryHub] = None):
+        super().__init__()
+        self.hub = hub or MemoryHub()
+
+    async def start(self, deliver: Deliver, reset: Optional[Reset] = None):
+        await super().start(deliver, reset)
+        with self.hub._lock:
+            self.hub.backplanes.append(self)
+            seq = self.hub.seq
+        self._subscribed(seq)
+
+    async def stop(self):
+        await super().stop()
+        with self.hub._lock:
+            if self in self.hub.backplanes:
+                self.hub.backplanes.remove(self)
+
+    async def _send(self, events: List[Event]):
+        self.hub.send(len(events), self._encode(events))
+
+    def _send_sync(self, events: List[Event]):
+        self.hub.send(len(events), self._encode(events))
+
+
+class RedisBackplane(Backplane):
+    """Backplane over one Redis pub/sub channel shared by every replica"""
+
+    def __init__(self, url: str = REDIS_URL, channel: str = WS_BACKPLANE_CHANNEL):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self.seq_key = f"{channel}:seq"
+        self._client = None
+        self._script = None
+        self._listener: Optional[asyncio.Task] = None
+        self._sync_client = None
+        self._sync_script = None
+
+    async def start(self, deliver: Deliver, reset: Optional[Reset] = None):
+        import redis.asyncio as redis_asyncio
+
+        await super().start(deliver, reset)
+        self._client = redis_asyncio.Redis.from_url(self.url)
+        self._script = self._client.register_script(_PUBLISH_SCRIPT)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        await super().stop()
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _listen(self):
+        delay = 1
+        while True:
+            try:
+                pubsub = self._client.pubsub()
+                await pubsub.subscribe(self.channel)
+                delay = 1
+                try:
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            first_seq, _, payload = message["data"].partition(b" ")
+                            self._receive(int(first_seq), payload)
+                        elif message["type"] == "subscribe":
+                            # Anything published before now was missed while unsubscribed
+                            self._subscribed(int(await self._client.get(self.seq_key) or 0))
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WebSocket backplane subscribe error: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _send(self, events: List[Event]):
+        await self._script(keys=[self.seq_key, self.channel], args=[len(events), self._encode(events)])
+
+    def _send_sync(self, events: List[Event]):
+        if self._sync_client is None:
+            import redis
+
+            # Bounded, so an unreachable Redis cannot hang a Celery sweep
+            self._sync_client = redis.Redis.from_url(self.url, socket_timeout=5, socket_connect_timeout=5)
+            self._sync_script = self._sync_client.register_script(_PUBLISH_SCRIPT)
+        self._sync_script(keys=[self.seq_key, self.channel], args=[len(events), self._encode(events)])
+
+
+_backplane: Optional[Backplane] = None
+
+
+def get_backplane() -> Backplane:
+    """Return the process-wide backplane selected by WS_BACKPLANE"""
+    global _backplane
+    if _backplane is None:
+        _backplane = MemoryBackplane() if WS_BACKPLANE == "memory" else RedisBackplane()
+    return _backplane
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from ws_manager import Connection, ConnectionManager
+from ws_replay import ReplayBuffer, SequencedEvent
+
+WS_COALESCE_INTERVAL = float(os.getenv("WS_COALESCE_INTERVAL", "0.25"))  # seconds; 0 sends every event on its own
+WS_COALESCE_MAX_DEVICES = int(os.getenv("WS_COALESCE_MAX_DEVICES", "2000"))  # devices per frame
+
+COALESCED_TYPE = "device_status_change"
+BATCH_TYPE = "device_status_batch"
+RESYNC_TYPE = "resync"
+_MISSING = object()
+
+
+class StatusCoalescer:
+    """
+    Turns device_status_change events into one device_status_batch frame per
+    connection every WS_COALESCE_INTERVAL seconds.
+
+    Events for the same device within a tick are merged, and each device
+    only carries the fields that differ from the last frame sent for it, so
+    a device that flapped back to its previous status, or a change already
+    reported by another replica, is left out. The
+    newest event time is sent once per frame; a device only carries its own
+    ``timestamp`` when it differs. Connections that would receive the same
+    devices share one serialized frame. Other events are published as they
+    arrive, after flushing the tick so far.
+
+    Frames carry the backplane sequence number of the newest event sent so
+    far, and every event is kept in a per-topic ReplayBuffer, so a client
+    that comes back with that ``last_seq`` is sent only what it missed
+    (see resume()).
+    """
+
+    def __init__(self, manager: ConnectionManager, interval: float = WS_COALESCE_INTERVAL,
+                 replay: Optional[ReplayBuffer] = None):
+        self.manager = manager
+        self.interval = interval
+        self.replay = replay or ReplayBuffer()
+        self._seq: Optional[int] = None  # newest sequence number delivered
+        # device_id -> (topics, merged fields, timestamp) for the current tick
+        self._pending: Dict[str, Tuple[List[str], Dict[str, Any], Optional[str]]] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}  # device_id -> fields as last sent
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.events = 0
+        self.frames_encoded = 0
+
+    def reset(self, seq: int):
+        """Backplane callback: it (re)subscribed and sees every event after ``seq``"""
+        self.replay.reset(seq)
+
+    def deliver(self, seq: Optional[int], topics: List[str], message: Dict[str, Any]):
+        """Backplane callback: coalesce status changes, publish anything else now"""
+        if seq is None:
+            self.replay.invalidate()
+        else:
+            self.replay.add(seq, topics, message)
+            self._seq = seq if self._seq is None else max(self._seq, seq)
+        if message.get("type") != COALESCED_TYPE or self.interval <= 0:
+            if self._pending:
+                self.flush()  # keep frames in sequence order
+            self.manager.seq = self._seq
+            self.manager.publish(topics, json.dumps({**message, "seq": self._seq}))
+            return
+        fields = dict(message["data"])
+        device_id = str(fields.pop("device_id"))
+        timestamp = fields.pop("timestamp", None)
+        self.events += 1
+        pending = self._pending.get(device_id)
+        if pending is None:
+            self._pending[device_id] = (topics, fields, timestamp)
+        else:
+            pending[1].update(fields)
+            self._pending[device_id] = (topics, pending[1], max(pending[2] or "", timestamp or "") or None)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def _deltas(self) -> Dict[str, Tuple[List[str], Dict[str, Any], Optional[str]]]:
+        deltas = {}
+        for device_id, (topics, fields, timestamp) in self._pending.items():
+            last = self._last.setdefault(device_id, {})
+            delta = {name: value for name, value in fields.items() if last.get(name, _MISSING) != value}
+            if delta:
+                last.update(delta)
+                deltas[device_id] = (topics, delta, timestamp)
+        self._pending = {}
+        return deltas
+
+    def flush(self):
+        """Send this tick's changes: one frame per connection, shared between identical ones"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        deltas = self._deltas()
+        self.manager.seq = self._seq
+        if not deltas:
+            return
+
+        # Devices in the same order for every connection, so equal lists mean equal frames
+        recipients: Dict[Connection, List[str]] = {}
+        for device_id, (topics, _, _) in deltas.items():
+            for topic in topics:
+                for connection in self.manager.topics.get(topic, ()):
+                    devices = recipients.setdefault(connection, [])
+                    if not devices or devices[-1] != device_id:
+                        devices.append(device_id)
+
+        frames: Dict[Tuple[str, ...], List[str]] = {}
+        for connection, devices in recipients.items():
+            key = tuple(devices)
+            encoded = frames.get(key)
+            if encoded is None:
+                encoded = frames[key] = self._encode(devices, deltas, self._seq)
+            for frame in encoded:
+                self.manager.send(connection, frame)
+
+    def resume(self, connection: Connection, last_seq: int) -> bool:
+        """
+        Send a connection the events on its topics after ``last_seq``, with
+        each device's changes merged into one state. When the gap is not
+        fully held in the replay buffer, send a resync message instead,
+        telling the client to reload device state; returns False then.
+        """
+        events = self.replay.since(connection.topics, last_seq)
+        if events is None:
+            self.manager.send(connection, json.dumps({"type": RESYNC_TYPE, "seq": self._seq, "data": {"last_seq": last_seq}}))
+            return False
+        for frame in self._encode_replay(events):
+            self.manager.send(connection, frame)
+        return True
+
+    def _encode_replay(self, events: List[SequencedEvent]) -> List[str]:
+        """Other events in order, then the merged device states; only the last frame carries seq"""
+        others = []
+        states: Dict[str, Tuple[List[str], Dict[str, Any], Optional[str]]] = {}
+        for seq, topics, message in events:
+            if message.get("type") != COALESCED_TYPE:
+                others.append({**message, "seq": None})
+                continue
+            fields = dict(message["data"])
+            device_id = str(fields.pop("device_id"))
+            timestamp = fields.pop("timestamp", None)
+            state = states.get(device_id)
+            if state is not None:
+                fields = {**state[1], **fields}
+                timestamp = max(state[2] or "", timestamp or "") or None
+            states[device_id] = (topics, fields, timestamp)
+        last_seq = events[-1][0] if events else None
+        if others and not states:
+            others[-1]["seq"] = last_seq
+        frames = [json.dumps(message) for message in others]
+        if states:
+            frames.extend(self._encode(list(states), states, last_seq))
+        return frames
+
+    def _encode(self, devices: List[str], deltas: Dict[str, Tuple[List[str], Dict[str, Any], Optional[str]]],
+                seq: Optional[int]) -> List[str]:
+        """device_status_batch frames of at most WS_COALESCE_MAX_DEVICES; only the last carries seq"""
+        encoded = []
+        for first in range(0, len(devices), WS_COALESCE_MAX_DEVICES):
+            chunk = devices[first:first + WS_COALESCE_MAX_DEVICES]
+            timestamp = max((deltas[device_id][2] or "" for device_id in chunk), default="") or None
+            data = {}
+            for device_id in chunk:
+                _, delta, device_timestamp = deltas[device_id]
+                if device_timestamp != timestamp:
+                    delta = {**delta, "timestamp": device_timestamp}
+                data[device_id] = delta
+            last = first + WS_COALESCE_MAX_DEVICES >= len(devices)
+            encoded.append(json.dumps(
+                {"type": BATCH_TYPE, "seq": seq if last else None, "data": {"timestamp": timestamp, "devices": data}},
+                separators=(",", ":"),
+            ))
+            self.frames_encoded += 1
+        return encoded
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "pending_devices": len(self._pending),
+            "events": self.events,
+            "frames_encoded": self.frames_encoded,
+            "seq": self._seq,
+            "replay": self.replay.stats(),
+        }
+
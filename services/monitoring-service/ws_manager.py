@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))  # messages waiting per connection
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))  # seconds one send may block
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "30"))  # seconds
+# What to do when a connection's queue is full: "disconnect" closes it so the
+# client reconnects and resyncs, "drop_oldest" sheds its oldest queued messages
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")
+
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def organization_topic(organization_id: Any) -> str:
+    return f"org:{organization_id}"
+
+
+def device_topic(device_id: Any) -> str:
+    return f"device:{device_id}"
+
+
+def device_type_topic(organization_id: Any, device_type: str) -> str:
+    # Scoped to the organization so one tenant's subscription never sees another's devices
+    return f"device_type:{organization_id}:{device_type}"
+
+
+def event_topics(organization_id: Any, device_id: Any, device_type: Optional[str] = None) -> List[str]:
+    """Every topic an event about one device is delivered on"""
+    topics = [organization_topic(organization_id), device_topic(device_id)]
+    if device_type:
+        topics.append(device_type_topic(organization_id, device_type))
+    return topics
+
+
+def parse_subscriptions(organization_id: Any, names: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Map client topic names to topic keys within the caller's organization:
+    "organization", "device:<uuid>" and "device_type:<type>". Returns the
+    accepted names with their keys, and the names that are not valid topics.
+    Device ids still have to be checked against the organization.
+    """
+    accepted, rejected = {}, []
+    for name in names:
+        kind, _, value = str(name).partition(":")
+        if kind == "organization" and not value:
+            accepted[name] = organization_topic(organization_id)
+        elif kind == "device" and value:
+            accepted[name] = device_topic(value)
+        elif kind == "device_type" and value:
+            accepted[name] = device_type_topic(organization_id, value)
+        else:
+            rejected.append(name)
+    return accepted, rejected
+
+
+class Connection:
+    """One client socket with its bounded outbound queue and writer task"""
+
+    __slots__ = ("websocket", "queue", "writer", "dropped", "closed", "topics")
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.topics: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+
+
+class ConnectionManager:
+    """
+    WebSocket fan-out where no client can hold up another.
+
+    Every connection has a queue of at most WS_SEND_QUEUE_SIZE messages and
+    its own writer task draining it, so broadcast() only enqueues the
+    already serialized message on each connection and never awaits a socket.
+    A connection whose queue is full is handled by WS_SLOW_CONSUMER_POLICY,
+    and one whose send blocks for WS_SEND_TIMEOUT seconds is closed.
+    Connections live in a dict, so disconnecting is O(1).
+
+    Events are published to topics (an organization, a device, or a device
+    type within an organization); a topic -> connections index means each
+    event only touches the sockets subscribed to it. All methods must be
+    called from the event loop thread.
+    """
+
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.topics: Dict[str, Set[Connection]] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.seq: Optional[int] = None  # newest event sequence number queued to every subscriber
+        self.messages_dropped = 0
+        self.slow_disconnects = 0
+
+    async def connect(self, websocket: WebSocket) -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket, self.queue_size)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self.connections[websocket] = connection
+        return connection
+
+    def disconnect(self, websocket: WebSocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is not None and not connection.closed:
+            connection.closed = True
+            self.unsubscribe(connection, list(connection.topics))
+            if connection.writer is not asyncio.current_task():
+                connection.writer.cancel()
+
+    def subscribe(self, connection: Connection, topics: Iterable[str]):
+        if connection.closed:
+            return
+        for topic in topics:
+            self.topics.setdefault(topic, set()).add(connection)
+            connection.topics.add(topic)
+
+    def unsubscribe(self, connection: Connection, topics: Iterable[str]):
+        for topic in topics:
+            connection.topics.discard(topic)
+            subscribers = self.topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.topics[topic]
+
+    def publish(self, topics: Iterable[str], message: str):
+        """Queue a serialized message once for every connection subscribed to any of the topics"""
+        recipients: Set[Connection] = set()
+        for topic in topics:
+            subscribers = self.topics.get(topic)
+            if subscribers:
+                recipients.update(subscribers)
+        for connection in recipients:
+            self.send(connection, message)
+
+    def send(self, connection: Connection, message: str):
+        """Queue a message for one connection, applying the slow consumer policy if it is full"""
+        if connection.closed:
+            return
+        try:
+            connection.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == "drop_oldest":
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(message)
+            connection.dropped += 1
+            self.messages_dropped += 1
+        else:
+            self.slow_disconnects += 1
+            self.disconnect(connection.websocket)
+            asyncio.create_task(self._close(connection.websocket, "send queue full"))
+
+    def broadcast(self, message: str):
+        """Queue a serialized message for every connection without waiting on any socket"""
+        for connection in list(self.connections.values()):
+            self.send(connection, message)
+
+    async def _write(self, connection: Connection):
+        websocket = connection.websocket
+        try:
+            while True:
+                message = await connection.queue.get()
+                # Not wait_for, which can swallow a cancel that lands as the send completes
+                async with asyncio.timeout(WS_SEND_TIMEOUT):
+                    await websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.slow_disconnects += 1
+            self.disconnect(websocket)
+            await self._close(websocket, "send timed out")
+        except Exception:
+            # The client went away; the endpoint's receive loop sees it too
+            self.disconnect(websocket)
+
+    async def _close(self, websocket: WebSocket, reason: str):
+        try:
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER, reason=reason)
+        except Exception:
+            pass
+
+    def start(self):
+        """Start sending heartbeats to every connection"""
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._send_heartbeats())
+
+    async def _send_heartbeats(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            # Carries seq so idle subscribers can still resume from a recent position
+            self.broadcast(json.dumps({"type": "heartbeat", "data": "alive", "seq": self.seq}))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self.connections),
+            "topics": len(self.topics),
+            "queued": sum(connection.queue.qsize() for connection in self.connections.values()),
+            "queue_size": self.queue_size,
+            "policy": self.policy,
+            "messages_dropped": self.messages_dropped,
+            "slow_disconnects": self.slow_disconnects,
+        }
@@ -0,0 +1,129 @@
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+WS_REPLAY_TOPIC_EVENTS = int(os.getenv("WS_REPLAY_TOPIC_EVENTS", "1000"))  # events kept per topic
+WS_REPLAY_MAX_TOPICS = int(os.getenv("WS_REPLAY_MAX_TOPICS", "10000"))  # rings kept; least recently fed dropped first
+WS_REPLAY_TOPIC_TTL = float(os.getenv("WS_REPLAY_TOPIC_TTL", "900"))  # seconds a ring is kept without new events
+
+# (seq, topics, message)
+SequencedEvent = Tuple[int, List[str], Dict[str, Any]]
+
+
+class _TopicRing:
+    __slots__ = ("events", "evicted_upto", "touched")
+
+    def __init__(self, size: int):
+        self.events: deque = deque(maxlen=size)
+        self.evicted_upto = 0  # seq of the newest event pushed out of the ring
+        self.touched = 0.0
+
+
+class ReplayBuffer:
+    """
+    The last WS_REPLAY_TOPIC_EVENTS events of every topic, by backplane
+    sequence number, so a reconnecting client can be sent what it missed.
+
+    ``base`` is the sequence number after which this process has seen every
+    event; it is set when the backplane (re)subscribes and raised when an
+    event has to bypass the sequence. A gap can be replayed when it starts
+    after ``base`` and after everything the client's topics have evicted.
+    Events are shared between the rings of their topics, not copied.
+
+    At most WS_REPLAY_MAX_TOPICS rings are kept, and rings without events
+    for WS_REPLAY_TOPIC_TTL seconds are dropped, least recently fed first.
+    Whether a topic without a ring had events is then unknown, so a gap on
+    it starting before the newest dropped event is answered with a resync.
+    """
+
+    def __init__(
+        self,
+        topic_events: int = WS_REPLAY_TOPIC_EVENTS,
+        max_topics: int = WS_REPLAY_MAX_TOPICS,
+        topic_ttl: float = WS_REPLAY_TOPIC_TTL,
+    ):
+        self.topic_events = topic_events
+        self.max_topics = max_topics
+        self.topic_ttl = topic_ttl
+        self._rings: "OrderedDict[str, _TopicRing]" = OrderedDict()
+        self.dropped_upto = 0  # newest seq held by a ring that has been dropped
+        self.base: Optional[int] = None  # nothing can be replayed until the backplane reports a position
+        self.newest = 0
+        self.replays = 0
+        self.resyncs = 0
+
+    def reset(self, seq: int):
+        """Every event after ``seq`` will be seen from now on"""
+        if seq < self.newest:
+            self._rings.clear()  # the sequence itself was reset, e.g. Redis lost its counter
+            self.newest = seq
+            self.dropped_upto = 0
+        self.base = seq
+
+    def invalidate(self):
+        """An event was delivered without a sequence number; gaps up to now cannot be replayed"""
+        self.base = max(self.base or 0, self.newest)
+
+    def add(self, seq: int, topics: Iterable[str], message: Dict[str, Any]):
+        event = (seq, topics, message)
+        self.newest = max(self.newest, seq)
+        now = time.monotonic()
+        for topic in topics:
+            ring = self._rings.get(topic)
+            if ring is None:
+                ring = self._rings[topic] = _TopicRing(self.topic_events)
+            else:
+                self._rings.move_to_end(topic)
+                if len(ring.events) == self.topic_events:
+                    ring.evicted_upto = ring.events[0][0]
+            ring.touched = now
+            ring.events.append(event)
+        self._drop(now)
+
+    def _drop(self, now: float):
+        rings = self._rings
+        while rings:
+            ring = next(iter(rings.values()))
+            if len(rings) <= self.max_topics and ring.touched >= now - self.topic_ttl:
+                break
+            rings.popitem(last=False)
+            self.dropped_upto = max(self.dropped_upto, ring.events[-1][0])
+
+    def since(self, topics: Iterable[str], last_seq: int) -> Optional[List[SequencedEvent]]:
+        """
+        Events on any of the topics after ``last_seq``, oldest first, or
+        None when part of that gap is no longer (or never was) held here
+        """
+        if self.base is None or last_seq < self.base or last_seq > max(self.newest, self.base):
+            self.resyncs += 1
+            return None
+        self._drop(time.monotonic())
+        events: Dict[int, SequencedEvent] = {}
+        for topic in topics:
+            ring = self._rings.get(topic)
+            if ring is None:
+                if last_seq < self.dropped_upto:
+                    self.resyncs += 1
+                    return None
+                continue
+            if ring.evicted_upto > last_seq:
+                self.resyncs += 1
+                return None
+            for event in reversed(ring.events):
+                if event[0] <= last_seq:
+                    break
+                events[event[0]] = event
+        self.replays += 1
+        return [events[seq] for seq in sorted(events)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "topics": len(self._rings),
+            "dropped_upto": self.dropped_upto,
+            "events": sum(len(ring.events) for ring in self._rings.values()),
+            "base": self.base,
+            "newest": self.newest,
+            "replays": self.replays,
+            "resyncs": self.resyncs,
+        }
@@ -1,4 +1,5 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 import httpx
 import os
@@ -15,6 +16,7 @@ app = FastAPI(
 )
 
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8001")
+MONITORING_SERVICE_URL = os.getenv("MONITORING_SERVICE_URL", "http://monitoring-service:8003")
 
 
 async def get_current_user(authorization: str = Header(...)):
@@ -58,6 +60,54 @@ def get_alert_summary(
     return report
 
 
+@app.get("/metrics-report/{device_id}")
+async def get_device_metrics_report(
+    device_id: str,
+    metric_type: str,
+    hours: int = 24,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    authorization: str = Header(...),
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream device metrics as NDJSON or CSV from the monitoring service's export"""
+    client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None))
+    request = client.build_request(
+        "GET",
+        f"{MONITORING_SERVICE_URL}/metrics/{device_id}/export",
+        params={"metric_type": metric_type, "hours": hours, "format": format},
+        headers={"Authorization": authorization}
+    )
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.RequestError:
+        await client.aclose()
+        raise HTTPException(status_code=503, detail="Monitoring service unavailable")
+    if response.status_code != 200:
+        try:
+            await response.aread()
+            detail = response.json().get("detail", "Metrics export failed")
+        except (httpx.HTTPError, ValueError, AttributeError):
+            detail = "Metrics export failed"
+        finally:
+            await response.aclose()
+            await client.aclose()
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+    async def body():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+            await client.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type=response.headers.get("content-type", "").split(";")[0],
+        headers={"Content-Disposition": f'attachment; filename="{device_id}-{metric_type}.{format}"'}
+    )
+
+
 @app.get("/overview/{organization_id}")
 def get_organization_overview(
     organization_id: str,
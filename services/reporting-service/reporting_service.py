@@ -125,31 +125,6 @@ class ReportingService:
         except ValueError:
             return {}
 
-    def get_device_metrics_report(self, device_id: str, metric_type: str, hours: int = 24) -> List[Dict[str, Any]]:
-        """Get device metrics for reporting"""
-        try:
-            device_uuid = uuid.UUID(device_id)
-            start_time = datetime.utcnow() - timedelta(hours=hours)
-            
-            metrics = (self.db.query(models.DeviceMetric)
-                      .filter(models.DeviceMetric.device_id == device_uuid)
-                      .filter(models.DeviceMetric.metric_type == metric_type)
-                      .filter(models.DeviceMetric.time >= start_time)
-                      .order_by(models.DeviceMetric.time)
-                      .all())
-            
-            return [
-                {
-                    "timestamp": metric.time.isoformat(),
-                    "value": metric.value,
-                    "unit": metric.unit
-                }
-                for metric in metrics
-            ]
-            
-        except ValueError:
-            return []
-
     def get_organization_overview(self, organization_id: str) -> Dict[str, Any]:
         """Get high-level organization overview"""
         try: